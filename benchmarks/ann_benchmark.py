@@ -0,0 +1,215 @@
+import argparse
+import json
+import math
+import os
+import platform
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from benchmarks.run_benchmark import git_commit, percentile, summarize_latencies
+from phase_2.backend.ann_index import apply_search_settings, build_index, get_factory_string
+from phase_2.backend.vector_store_loader import CHUNKS_FILE, get_artifact_dir
+from phase_2.llm_client import QA_SCORE_THRESHOLD
+
+# Index settings compared against exact flat search
+DEFAULT_CONFIGS = [
+    {"type": "flat", "quantization": "sq8"},
+    {"type": "flat", "quantization": "pq"},
+    {"type": "hnsw", "quantization": "none"},
+    {"type": "hnsw", "quantization": "sq8"},
+    {"type": "ivf", "quantization": "none"},
+    {"type": "ivf", "quantization": "sq8"},
+    {"type": "ivfpq", "quantization": "pq"},
+]
+
+
+def synthetic_corpus(size: int, dimension: int, clusters: int, queries: int, seed: int):
+    """
+    This function is used to generate normalized vectors grouped in topics, like the embeddings of a service catalogue.
+
+    Returns: tuple of the corpus and the query vectors
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension)).astype(np.float32)
+
+    def sample(count):
+        vectors = centers[rng.integers(0, clusters, count)] + rng.normal(scale=0.6, size=(count, dimension))
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+    return sample(size), sample(queries)
+
+
+def knowledge_base_corpus(artifact_dir: Path, queries: int, noise: float, seed: int):
+    """
+    This function is used to read the embeddings of a built knowledge base index. The queries are chunk embeddings
+    moved by random noise, so their nearest neighbours are the chunk and the chunks around it.
+
+    Returns: tuple of the corpus and the query vectors, None when the index was not built
+    """
+    chunks_path = artifact_dir / CHUNKS_FILE
+    if not chunks_path.exists():
+        return None
+    connection = sqlite3.connect(f"file:{chunks_path}?mode=ro", uri=True)
+    try:
+        corpus = np.vstack([np.frombuffer(row[0], dtype=np.float32)
+                            for row in connection.execute("SELECT embedding FROM chunks ORDER BY position")])
+    finally:
+        connection.close()
+    rng = np.random.default_rng(seed)
+    picked = corpus[rng.integers(0, len(corpus), queries)]
+    picked = picked + rng.normal(scale=noise / math.sqrt(corpus.shape[1]), size=picked.shape)
+    return corpus, (picked / np.linalg.norm(picked, axis=1, keepdims=True)).astype(np.float32)
+
+
+def relevance(distances: np.ndarray) -> np.ndarray:
+    # Same relevance as the langchain FAISS store uses for the L2 distances of the index
+    return 1.0 - distances / math.sqrt(2)
+
+
+def evaluate(index, queries: np.ndarray, exact_ids: np.ndarray, exact_distances: np.ndarray, k: int,
+             threshold: float) -> dict:
+    """
+    This function is used to measure an index against the exact flat search results.
+
+    Returns: dict of recall@k, query latency and score threshold agreement
+    """
+    latencies = []
+    ids = np.empty_like(exact_ids)
+    distances = np.empty_like(exact_distances)
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        distances[i:i + 1], ids[i:i + 1] = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - started)
+
+    recall = np.mean([len(set(ids[i]) & set(exact_ids[i])) / k for i in range(len(queries))])
+    # Chunks the QA prompt would get (relevance above the threshold) with exact search, found above it here too
+    exact_kept = [set(exact_ids[i][relevance(exact_distances[i]) >= threshold]) for i in range(len(queries))]
+    kept = [set(ids[i][relevance(distances[i]) >= threshold]) for i in range(len(queries))]
+    total_kept = sum(len(chunks) for chunks in exact_kept)
+    score_errors = []
+    for i in range(len(queries)):
+        exact_scores = dict(zip(exact_ids[i], relevance(exact_distances[i])))
+        score_errors.extend(abs(score - exact_scores[chunk]) for chunk, score in zip(ids[i], relevance(distances[i]))
+                            if chunk in exact_scores)
+    return {
+        f"recall_at_{k}": round(float(recall), 4),
+        "threshold_recall": round(sum(len(kept[i] & exact_kept[i]) for i in range(len(queries))) / total_kept, 4)
+        if total_kept else None,
+        "mean_score_error": round(float(np.mean(score_errors)), 5) if score_errors else None,
+        "latency": summarize_latencies(latencies),
+    }
+
+
+def run_corpus(name: str, corpus: np.ndarray, queries: np.ndarray, args) -> dict:
+    """
+    This function is used to compare every index setting on one corpus.
+    """
+    import faiss
+
+    print(f"{name}: {len(corpus)} vectors of dimension {corpus.shape[1]}, {len(queries)} queries", file=sys.stderr)
+    flat = build_index(corpus, {"type": "flat", "quantization": "none"})
+    exact_distances, exact_ids = flat.search(queries, args.k)
+    top_scores = relevance(exact_distances[:, 0]).tolist()
+    results = {
+        "vectors": len(corpus),
+        "dimension": int(corpus.shape[1]),
+        # Where the score threshold falls among the best matches of exact search
+        "top1_relevance": {f"p{p}": round(percentile(top_scores, p), 4) for p in (5, 25, 50, 75, 95)},
+        "indexes": [],
+    }
+
+    for settings in [{"type": "flat", "quantization": "none"}, *args.configs]:
+        settings = {**settings, "hnsw_m": args.hnsw_m, "ivf_nlist": args.nlist, "pq_m": args.pq_m}
+        started = time.perf_counter()
+        index = flat if settings["type"] == "flat" and settings["quantization"] == "none" else build_index(corpus, settings)
+        build_seconds = time.perf_counter() - started
+        if settings["type"] == "hnsw":
+            sweep = [{"efSearch": ef_search, "nprobe": 0} for ef_search in args.ef_search]
+        elif settings["type"] in ("ivf", "ivfpq"):
+            sweep = [{"efSearch": 0, "nprobe": nprobe} for nprobe in args.nprobe]
+        else:
+            sweep = [{}]
+        for search_settings in sweep:
+            if search_settings:
+                apply_search_settings(index, search_settings)
+            result = {
+                "index": get_factory_string(settings, corpus.shape[1], len(corpus)),
+                "settings": {key: value for key, value in search_settings.items() if value},
+                "build_seconds": round(build_seconds, 3),
+                "memory_bytes": int(faiss.serialize_index(index).nbytes),
+                **evaluate(index, queries, exact_ids, exact_distances, args.k, args.threshold),
+            }
+            print(f"  {result['index']:<20} {json.dumps(result['settings']):<20} recall@{args.k} "
+                  f"{result[f'recall_at_{args.k}']:.3f}  p50 {result['latency']['p50_ms']:.3f}ms  "
+                  f"{result['memory_bytes'] / 2 ** 20:.1f}MB", file=sys.stderr)
+            results["indexes"].append(result)
+    return results
+
+
+def parse_configs(value: str) -> list:
+    """
+    This function is used to read index settings written as type/quantization pairs, e.g. "hnsw/sq8,ivfpq".
+    """
+    configs = []
+    for item in value.split(","):
+        index_type, _, quantization = item.strip().partition("/")
+        configs.append({"type": index_type, "quantization": quantization or ("pq" if index_type == "ivfpq" else "none")})
+    return configs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall, latency and memory of the FAISS index types against "
+                                                 "exact flat search.")
+    parser.add_argument("--corpus", choices=["synthetic", "kb", "all"], default="all")
+    parser.add_argument("--vectors", type=int, default=20000, help="size of the synthetic corpus")
+    parser.add_argument("--dimension", type=int, default=1536, help="dimension of the synthetic vectors")
+    parser.add_argument("--clusters", type=int, default=200, help="topics of the synthetic corpus")
+    parser.add_argument("--artifact-dir", default=str(get_artifact_dir()), help="built knowledge base index")
+    parser.add_argument("--noise", type=float, default=0.5, help="distance of the knowledge base queries from a chunk")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=8, help="neighbours per query, QA_RETRIEVAL_K by default")
+    parser.add_argument("--threshold", type=float, default=QA_SCORE_THRESHOLD, help="relevance score threshold")
+    parser.add_argument("--configs", type=parse_configs, default=DEFAULT_CONFIGS,
+                        help="index settings to compare, e.g. hnsw/none,hnsw/sq8,ivf/sq8,ivfpq")
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-search", type=lambda value: [int(v) for v in value.split(",")], default=[16, 64, 128])
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists, 0 picks about 4 * sqrt(vectors)")
+    parser.add_argument("--nprobe", type=lambda value: [int(v) for v in value.split(",")], default=[1, 8, 32])
+    parser.add_argument("--pq-m", type=int, default=64, help="bytes per vector of product quantization")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="ann_bench_output.json", help="machine readable results file")
+    args = parser.parse_args()
+
+    results = {}
+    if args.corpus in ("synthetic", "all"):
+        corpus, queries = synthetic_corpus(args.vectors, args.dimension, args.clusters, args.queries, args.seed)
+        results["synthetic"] = run_corpus("synthetic", corpus, queries, args)
+    if args.corpus in ("kb", "all"):
+        knowledge_base = knowledge_base_corpus(Path(args.artifact_dir), args.queries, args.noise, args.seed)
+        if knowledge_base is None:
+            print(f"No knowledge base index in {args.artifact_dir}, skipping it", file=sys.stderr)
+        else:
+            results["knowledge_base"] = run_corpus("knowledge_base", *knowledge_base, args)
+
+    config = {key: value for key, value in vars(args).items() if key != "configs"}
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {**config, "configs": [f"{c['type']}/{c['quantization']}" for c in args.configs]},
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
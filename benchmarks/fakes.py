@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Any, List, Optional
+
+import numpy as np
+from azure.ai.formrecognizer import AnalyzeResult
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class StageTimer:
+    """
+    Thread safe collector of the durations of every pipeline stage.
+    """
+
+    def __init__(self):
+        self._durations = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self._durations[stage].append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {stage: list(values) for stage, values in self._durations.items()}
+
+
+STAGE_TIMER = StageTimer()
+
+
+class Latency:
+    """
+    Deterministic latency model: a base delay plus a uniform jitter drawn from a seeded generator.
+    """
+
+    def __init__(self, seconds: float, jitter: float = 0.0, seed: int = 0):
+        self.seconds = seconds
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            return max(0.0, self.seconds + self._random.uniform(-self.jitter, self.jitter))
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Stand-in for AzureChatOpenAI that answers with a fixed response after a configurable latency.
+    Streaming sends the response word by word, the latency is spread between the first token and the rest.
+    """
+
+    response: str
+    latency: Any
+    stage: str = "llm"
+    first_token_ratio: float = 0.3
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-azure-chat"
+
+    def _message(self) -> AIMessage:
+        completion_tokens = len(self.response.split())
+        return AIMessage(content=self.response,
+                         usage_metadata={"input_tokens": 0, "output_tokens": completion_tokens,
+                                         "total_tokens": completion_tokens})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        delay = self.latency.sample()
+        time.sleep(delay)
+        STAGE_TIMER.record(self.stage, delay)
+        return ChatResult(generations=[ChatGeneration(message=self._message())])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        delay = self.latency.sample()
+        await asyncio.sleep(delay)
+        STAGE_TIMER.record(self.stage, delay)
+        return ChatResult(generations=[ChatGeneration(message=self._message())])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        delay = self.latency.sample()
+        words = self.response.split(" ")
+        started = time.perf_counter()
+        await asyncio.sleep(delay * self.first_token_ratio)
+        STAGE_TIMER.record(f"{self.stage}_first_token", time.perf_counter() - started)
+        per_token = delay * (1 - self.first_token_ratio) / max(1, len(words))
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(per_token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+        STAGE_TIMER.record(self.stage, time.perf_counter() - started)
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Stand-in for AzureOpenAIEmbeddings, vectors are derived from a hash of the text so equal texts get equal vectors.
+    Every call waits the configured latency, like one round trip per request.
+    """
+
+    def __init__(self, latency: Latency, size: int = 256, stage: str = "embedding"):
+        self.latency = latency
+        self.size = size
+        self.stage = stage
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.size).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        delay = self.latency.sample()
+        time.sleep(delay)
+        STAGE_TIMER.record(self.stage, delay)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        delay = self.latency.sample()
+        await asyncio.sleep(delay)
+        STAGE_TIMER.record(self.stage, delay)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class _FakePoller:
+    def __init__(self, result: AnalyzeResult, delay: float):
+        self._result = result
+        self._delay = delay
+
+    def result(self) -> AnalyzeResult:
+        time.sleep(self._delay)
+        STAGE_TIMER.record("ocr", self._delay)
+        return self._result
+
+
+class FakeDocumentAnalysisClient:
+    """
+    Stand-in for DocumentAnalysisClient, every document "contains" the given OCR text.
+    """
+
+    def __init__(self, latency: Latency, content: Optional[str] = None):
+        self.latency = latency
+        self.content = content or SAMPLE_OCR_TEXT
+
+    def begin_analyze_document(self, model_id: str, document, **kwargs) -> _FakePoller:
+        lines, pairs, offset = [], [], 0
+        for line in self.content.splitlines():
+            lines.append({"content": line, "spans": [{"offset": offset, "length": len(line)}]})
+            key, separator, value = line.partition(":")
+            if separator and value.strip() and not key.strip().startswith(":"):
+                value_offset = offset + len(key) + 1 + (len(value) - len(value.lstrip()))
+                pairs.append({"key": {"content": key.strip(), "spans": [{"offset": offset, "length": len(key)}]},
+                              "value": {"content": value.strip(),
+                                        "spans": [{"offset": value_offset, "length": len(value.strip())}]},
+                              "confidence": 0.9})
+            offset += len(line) + 1
+        result = AnalyzeResult.from_dict({
+            "api_version": "2023-07-31",
+            "model_id": model_id,
+            "content": self.content,
+            "pages": [{"page_number": 1, "lines": lines, "spans": [{"offset": 0, "length": len(self.content)}]}],
+            "key_value_pairs": pairs,
+        })
+        return _FakePoller(result, self.latency.sample())
+
+
+SAMPLE_OCR_TEXT = """המוסד לביטוח לאומי
+בקשה למתן טיפול רפואי לנפגע עבודה - עצמאי
+שם משפחה: כהן
+שם פרטי: ישראל
+מספר זהות: 123456782
+:selected: זכר :unselected: נקבה
+:unselected: :unselected: :unselected: :unselected: :unselected:
+מקום התאונה: :selected: במפעל :unselected: ת. דרכים בעבודה :unselected: ת. דרכים בדרך לעבודה/מהעבודה :unselected: אחר
+תאריך הפגיעה: 14.03.2024"""
+
+SAMPLE_FORM_JSON = """{"lastName": "כהן", "firstName": "ישראל", "idNumber": "123456782", "gender": "זכר",
+"dateOfBirth": {"day": "01", "month": "01", "year": "1980"}, "address": {"street": "", "houseNumber": "",
+"entrance": "", "apartment": "", "city": "", "postalCode": "", "poBox": ""}, "landlinePhone": "",
+"mobilePhone": "", "jobType": "", "dateOfInjury": {"day": "14", "month": "03", "year": "2024"},
+"timeOfInjury": "", "accidentLocation": "", "accidentAddress": "", "accidentDescription": "",
+"injuredBodyPart": "", "signature": "", "formFillingDate": {"day": "", "month": "", "year": ""},
+"formReceiptDateAtClinic": {"day": "", "month": "", "year": ""},
+"medicalInstitutionFields": {"healthFundMember": "", "natureOfAccident": "", "medicalDiagnoses": ""}}"""
+
+SAMPLE_INFO_JSON = """{"content": "Thanks, what is your HMO card number?", "user_info": {"full_name": "Israel Cohen",
+"id_number": "123456782", "gender": "male", "age": 40, "hmo_name": "Maccabi", "hmo_card_number": "",
+"membership_tier": "Gold", "is_confirmed": false}, "missing_fields": ["hmo_card_number"]}"""
+
+SAMPLE_QA_ANSWER = ("On the Maccabi Gold plan dental checkups and cleaning are free twice a year "
+                    "and an appointment is given within 48 hours.")
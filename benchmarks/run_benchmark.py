@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+sys.path.append(os.path.join(project_root, "phase_1"))
+
+# The local stand-ins have no Azure OpenAI quota, the benchmark measures the backend and not the rate limits
+for quota in ("AZURE_CHAT_RPM", "AZURE_CHAT_TPM", "AZURE_EMBEDDING_RPM", "AZURE_EMBEDDING_TPM"):
+    os.environ.setdefault(quota, "1e9")
+
+import httpx
+
+from benchmarks.fakes import (STAGE_TIMER, Latency, FakeChatModel, FakeEmbeddings, FakeDocumentAnalysisClient,
+                              SAMPLE_FORM_JSON, SAMPLE_INFO_JSON, SAMPLE_QA_ANSWER)
+
+QA_QUESTIONS = [
+    "How much does a dental cleaning cost?",
+    "Is acupuncture covered on my plan?",
+    "What is the discount for eye glasses?",
+    "כמה עולה טיפול שורש?",
+    "What pregnancy screening tests are included?",
+    "Do you offer a smoking cessation workshop?",
+]
+USER_INFO = {
+    "full_name": "Israel Cohen",
+    "id_number": "123456782",
+    "gender": "male",
+    "age": 40,
+    "hmo_name": "Maccabi",
+    "hmo_card_number": "123456789",
+    "membership_tier": "Gold",
+    "is_confirmed": True,
+}
+
+
+def percentile(values: list, percentile_value: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = (len(values) - 1) * percentile_value / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def summarize_latencies(values: list) -> dict:
+    milliseconds = [value * 1000 for value in values]
+    return {
+        "count": len(milliseconds),
+        "mean_ms": round(sum(milliseconds) / len(milliseconds), 2) if milliseconds else 0.0,
+        "p50_ms": round(percentile(milliseconds, 50), 2),
+        "p95_ms": round(percentile(milliseconds, 95), 2),
+        "p99_ms": round(percentile(milliseconds, 99), 2),
+    }
+
+
+def scenario_result(latencies: list, errors: int, wall_seconds: float) -> dict:
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 3),
+        "requests_per_second": round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+        "latency": summarize_latencies(latencies),
+        "stages": {stage: summarize_latencies(values) for stage, values in sorted(STAGE_TIMER.snapshot().items())},
+    }
+
+
+def install_phase_2_fakes(args):
+    """
+    This function is used to replace the Azure OpenAI clients of the backend with the local stand-ins
+    and build the knowledge base index with the fake embeddings in a temporary folder.
+    """
+    from phase_2.backend import azure_clients, vector_store_loader
+    from phase_2 import llm_client
+
+    azure_clients.CHAT_LLM = FakeChatModel(response=SAMPLE_INFO_JSON, stage="llm_chat",
+                                           latency=Latency(args.llm_latency, args.jitter, seed=1))
+    azure_clients.QA_LLM = FakeChatModel(response=SAMPLE_QA_ANSWER, stage="llm_qa",
+                                         latency=Latency(args.llm_latency, args.jitter, seed=2))
+    azure_clients.EMBEDDINGS = FakeEmbeddings(Latency(args.embedding_latency, args.jitter / 10, seed=3))
+
+    index_dir = tempfile.mkdtemp(prefix="kb-bench-")
+    started = time.perf_counter()
+    vector_store_loader.set_snapshot(*vector_store_loader.build_or_update_vector_store(artifact_dir=index_dir))
+    STAGE_TIMER.record("index_build", time.perf_counter() - started)
+
+    retrieve_documents = llm_client.retrieve_documents
+
+    async def timed_retrieve_documents(*retrieve_args, **retrieve_kwargs):
+        retrieve_started = time.perf_counter()
+        try:
+            return await retrieve_documents(*retrieve_args, **retrieve_kwargs)
+        finally:
+            STAGE_TIMER.record("retrieval", time.perf_counter() - retrieve_started)
+
+    llm_client.retrieve_documents = timed_retrieve_documents
+
+
+async def run_http_scenario(app, requests_total: int, concurrency: int, make_request) -> dict:
+    """
+    This function is used to send requests_total requests to the app with at most `concurrency` in flight.
+    Args:
+        app: ASGI app
+        requests_total: number of requests
+        concurrency: number of concurrent clients
+        make_request: async function (client, request number) -> None, raises on failure
+
+    Returns: scenario result
+    """
+    STAGE_TIMER.reset()
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def one(request_number):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await make_request(client, request_number)
+                    latencies.append(time.perf_counter() - started)
+                except Exception:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests_total)))
+        wall_seconds = time.perf_counter() - started
+
+    return scenario_result(latencies, errors, wall_seconds)
+
+
+async def run_phase_2(args) -> dict:
+    install_phase_2_fakes(args)
+    from phase_2.backend.answer_cache import ANSWER_CACHE
+    from phase_2.backend.embedding_cache import QUERY_EMBEDDING_CACHE
+    from phase_2.backend.main import app
+
+    index_build = summarize_latencies(STAGE_TIMER.snapshot().get("index_build", []))
+
+    async def chat(client, i):
+        response = await client.post("/chat", json={"user_prompt": "My name is Israel Cohen, ID 123456782"})
+        response.raise_for_status()
+
+    async def chat_slot_value(client, i):
+        # A bare slot value is answered by the local fast path without calling the LLM
+        response = await client.post("/chat", json={"user_prompt": "Maccabi, Gold"})
+        response.raise_for_status()
+
+    async def qa(client, i):
+        # Unique questions, every request pays for embedding, retrieval and the completion
+        question = f"{QA_QUESTIONS[i % len(QA_QUESTIONS)]} ({i})"
+        response = await client.post("/qa", json={"user_prompt": question, "user_info": USER_INFO})
+        response.raise_for_status()
+
+    async def qa_repeated(client, i):
+        question = QA_QUESTIONS[i % len(QA_QUESTIONS)]
+        response = await client.post("/qa", json={"user_prompt": question, "user_info": USER_INFO})
+        response.raise_for_status()
+
+    async def qa_stream(client, i):
+        # The in-process ASGI transport buffers the whole body, time to first token is the llm_qa_first_token stage
+        question = f"{QA_QUESTIONS[i % len(QA_QUESTIONS)]} (stream {i})"
+        async with client.stream("POST", "/qa/stream", json={"user_prompt": question, "user_info": USER_INFO}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line and json.loads(line).get("type") == "error":
+                    raise RuntimeError(line)
+
+    results = {"index_build": index_build}
+    scenarios = (("chat", chat), ("chat_slot_value", chat_slot_value), ("qa", qa), ("qa_repeated", qa_repeated),
+                 ("qa_stream", qa_stream))
+    for name, make_request in scenarios:
+        await ANSWER_CACHE.backend.clear()
+        QUERY_EMBEDDING_CACHE.clear()
+        results[name] = await run_http_scenario(app, args.requests, args.concurrency, make_request)
+    return results
+
+
+def run_phase_1(args) -> dict:
+    """
+    This function is used to run the phase 1 OCR + extraction path of the batch pipeline under concurrent load.
+    """
+    from app import extractor, ocr
+    from app.ocr_cache import OcrCache
+    import batch
+
+    ocr.client = FakeDocumentAnalysisClient(Latency(args.ocr_latency, args.jitter, seed=4))
+    extractor.llm = FakeChatModel(response=SAMPLE_FORM_JSON, stage="extraction",
+                                  latency=Latency(args.llm_latency, args.jitter, seed=5))
+    # A zero sized cache evicts every entry right away, so every file pays for OCR like a first run
+    ocr.OCR_CACHE = OcrCache(tempfile.mkdtemp(prefix="ocr-bench-"), max_bytes=0 if not args.ocr_cache else 1 << 30)
+
+    files = batch.collect_input_files(os.path.join(project_root, "phase_1", "data"))
+    files = [files[i % len(files)] for i in range(args.requests)]
+
+    STAGE_TIMER.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        records = list(executor.map(batch.process_file, files))
+    wall_seconds = time.perf_counter() - started
+
+    latencies = [record["total_seconds"] for record in records if record["status"] == "ok"]
+    return {"extract_form": scenario_result(latencies, len(records) - len(latencies), wall_seconds)}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=project_root, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmark with local Azure stand-ins.")
+    parser.add_argument("--phase", choices=["1", "2", "all"], default="all")
+    parser.add_argument("--requests", type=int, default=60, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="seconds per chat completion")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="seconds per embedding request")
+    parser.add_argument("--ocr-latency", type=float, default=2.0, help="seconds per Document Intelligence call")
+    parser.add_argument("--jitter", type=float, default=0.1, help="uniform +- jitter in seconds")
+    parser.add_argument("--ocr-cache", action="store_true", help="keep the OCR cache enabled in phase 1")
+    parser.add_argument("--output", default="bench_output.json", help="machine readable results file")
+    args = parser.parse_args()
+
+    results = {}
+    if args.phase in ("1", "all"):
+        results["phase_1"] = run_phase_1(args)
+    if args.phase in ("2", "all"):
+        results["phase_2"] = asyncio.run(run_phase_2(args))
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,7 +14,105 @@ AZURE_OPENAI_KEY = os.getenv("AZURE_OPENAI_KEY")
 AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_API_VERSION = os.getenv("AZURE_API_VERSION")
 OPENAI_ENGINE = "gpt-4o"
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Pooled keep-alive http transport shared by all Azure OpenAI calls of the backend
+AZURE_HTTP_MAX_CONNECTIONS = int(os.getenv("AZURE_HTTP_MAX_CONNECTIONS", "100"))
+AZURE_HTTP_MAX_KEEPALIVE = int(os.getenv("AZURE_HTTP_MAX_KEEPALIVE", "20"))
+AZURE_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("AZURE_HTTP_KEEPALIVE_EXPIRY", "60"))
+AZURE_HTTP_TIMEOUT = float(os.getenv("AZURE_HTTP_TIMEOUT", "60"))
 
 BACKEND_URL = "http://localhost:8000"  # or your deployed backend
 LANGUAGES = {"עברית": "he", "English": "en"}
 
+
+# Knowledge base source files and the folder of the persisted FAISS index
+KB_DATA_DIR = os.getenv("KB_DATA_DIR", str(Path(__file__).parent / "phase_2" / "data"))
+KB_INDEX_DIR = os.getenv("KB_INDEX_DIR", str(Path(__file__).parent / "phase_2" / "index"))
+# Local copy of the tokenizer data, tiktoken downloads it on first use otherwise
+TOKENIZER_CACHE_DIR = os.getenv("TOKENIZER_CACHE_DIR", str(Path(KB_INDEX_DIR) / "tokenizer"))
+# Start from the prebuilt artifacts only (index, tokenizer data), without reading the knowledge base or the network
+OFFLINE_STARTUP = os.getenv("OFFLINE_STARTUP", "false").lower() == "true"
+
+# QA answer cache, backend is "memory" (in-process LRU) or "redis"
+QA_CACHE_BACKEND = os.getenv("QA_CACHE_BACKEND", "memory")
+QA_CACHE_REDIS_URL = os.getenv("QA_CACHE_REDIS_URL", "redis://localhost:6379/0")
+QA_CACHE_MAX_ENTRIES = int(os.getenv("QA_CACHE_MAX_ENTRIES", "1000"))
+QA_CACHE_TTL_SECONDS = float(os.getenv("QA_CACHE_TTL_SECONDS", "3600"))
+QA_CACHE_SEMANTIC = os.getenv("QA_CACHE_SEMANTIC", "false").lower() == "true"
+QA_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("QA_CACHE_SEMANTIC_THRESHOLD", "0.95"))
+
+# On-disk cache of Document Intelligence results shared by the phase 1 UI and batch jobs
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", str(Path(__file__).parent / "phase_1" / ".ocr_cache"))
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Number of pages of one document analyzed in parallel
+OCR_PAGE_WORKERS = int(os.getenv("OCR_PAGE_WORKERS", "4"))
+
+# Server side chat sessions of the info collection phase, backend is "memory" or "redis"
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "memory")
+SESSION_STORE_REDIS_URL = os.getenv("SESSION_STORE_REDIS_URL", "redis://localhost:6379/0")
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+
+# Maximum number of tokens of knowledge base text sent in a QA prompt
+QA_CONTEXT_TOKEN_BUDGET = int(os.getenv("QA_CONTEXT_TOKEN_BUDGET", "1500"))
+
+# Number of recent chat messages sent with the structured state in every info collection turn
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "6"))
+
+# Number of question embeddings kept in memory, a repeated question skips the embedding request
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+
+# Record OpenTelemetry spans for every request and pipeline stage (needs opentelemetry and a configured exporter)
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+
+# Client side quota of the Azure OpenAI deployments (requests and tokens per minute), kept a bit under the
+# deployment quota so the backend queues its calls instead of being answered 429
+AZURE_CHAT_RPM = float(os.getenv("AZURE_CHAT_RPM", "300"))
+AZURE_CHAT_TPM = float(os.getenv("AZURE_CHAT_TPM", "50000"))
+AZURE_EMBEDDING_RPM = float(os.getenv("AZURE_EMBEDDING_RPM", "720"))
+AZURE_EMBEDDING_TPM = float(os.getenv("AZURE_EMBEDDING_TPM", "120000"))
+# Calls waiting for the quota of one deployment, the next ones are rejected right away with 503
+AZURE_MAX_QUEUE = int(os.getenv("AZURE_MAX_QUEUE", "64"))
+# Retries of a call answered 429, with jittered exponential backoff or the Retry-After of the answer
+AZURE_MAX_RETRIES = int(os.getenv("AZURE_MAX_RETRIES", "4"))
+AZURE_RETRY_BASE_SECONDS = float(os.getenv("AZURE_RETRY_BASE_SECONDS", "0.5"))
+AZURE_RETRY_MAX_SECONDS = float(os.getenv("AZURE_RETRY_MAX_SECONDS", "20"))
+# Completion tokens counted against the tokens per minute quota before the answer length is known
+CHAT_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("CHAT_COMPLETION_TOKENS_ESTIMATE", "300"))
+QA_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("QA_COMPLETION_TOKENS_ESTIMATE", "500"))
+
+# Phase 1 extraction service: SQLite job queue folder, worker threads and retries of a failed job
+JOBS_DIR = os.getenv("JOBS_DIR", str(Path(__file__).parent / "phase_1" / ".jobs"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_SECONDS = float(os.getenv("JOB_RETRY_SECONDS", "5"))
+EXTRACTION_SERVICE_URL = os.getenv("EXTRACTION_SERVICE_URL", "http://localhost:8001")
+
+# Index build embedding requests: chunks per request and requests in flight at the same time
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+
+# FAISS index of the knowledge base: type (flat, hnsw, ivf, ivfpq) and quantization of the stored vectors (none, sq8, pq)
+KB_INDEX_TYPE = os.getenv("KB_INDEX_TYPE", "flat")
+KB_INDEX_QUANTIZATION = os.getenv("KB_INDEX_QUANTIZATION", "none")
+KB_HNSW_M = int(os.getenv("KB_HNSW_M", "32"))
+KB_HNSW_EF_SEARCH = int(os.getenv("KB_HNSW_EF_SEARCH", "64"))
+# 0 picks about 4 * sqrt(number of chunks) lists
+KB_IVF_NLIST = int(os.getenv("KB_IVF_NLIST", "0"))
+KB_IVF_NPROBE = int(os.getenv("KB_IVF_NPROBE", "8"))
+# Bytes per vector of product quantization
+KB_PQ_M = int(os.getenv("KB_PQ_M", "64"))
+
+# Seconds between two checks of the knowledge base folder for changed files, 0 disables the automatic reload
+KB_RELOAD_INTERVAL_SECONDS = float(os.getenv("KB_RELOAD_INTERVAL_SECONDS", "30"))
+# Token expected in the X-Admin-Token header of the admin endpoints, they are disabled when it is not set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Streamlit frontend http client: pooled keep-alive connections to the backend, timeouts and retries
+BACKEND_POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", "10"))
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "3"))
+# Longest wait for an answer, or for the next line of a streamed answer
+BACKEND_READ_TIMEOUT = float(os.getenv("BACKEND_READ_TIMEOUT", "60"))
+BACKEND_MAX_RETRIES = int(os.getenv("BACKEND_MAX_RETRIES", "3"))
+BACKEND_RETRY_BACKOFF = float(os.getenv("BACKEND_RETRY_BACKOFF", "0.5"))
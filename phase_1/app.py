@@ -1,10 +1,47 @@
+import hashlib
 import streamlit as st
 import sys
 import os
+import requests
+
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.extractor import extract_fields_with_gpt
-from app.ocr import extract_text_from_file
+from config import EXTRACTION_SERVICE_URL
+
+# Seconds every status request waits on the service for the job to end
+POLL_WAIT_SECONDS = 30
+# Connect and read timeouts of the upload, the service answers as soon as the job is queued
+SUBMIT_TIMEOUT = (5, 30)
+
+
+def submit_form(uploaded_file) -> str:
+    """
+    This function is used to send the uploaded form to the extraction service.
+
+    Returns: the job id
+    """
+    response = requests.post(f"{EXTRACTION_SERVICE_URL}/jobs",
+                             files={"file": (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)},
+                             timeout=SUBMIT_TIMEOUT)
+    response.raise_for_status()
+    return response.json()["job_id"]
+
+
+def wait_for_job(job_id: str) -> dict:
+    """
+    This function is used to long poll the extraction service until the job succeeded or failed.
+
+    Returns: the job, None when the service does not know it
+    """
+    while True:
+        response = requests.get(f"{EXTRACTION_SERVICE_URL}/jobs/{job_id}", params={"wait": POLL_WAIT_SECONDS},
+                                timeout=POLL_WAIT_SECONDS + 10)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        job = response.json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
 
 
 st.title("National Insurance Institute Form Extractor (ביטוח לאומי)")
@@ -13,14 +50,37 @@ st.write("Upload a form (PDF or JPG) and extract structured data.")
 uploaded_file = st.file_uploader("Choose a file", type=["pdf", "jpg", "jpeg"])
 
 if uploaded_file:
-    with st.spinner("Processing OCR..."):
-        ocr_text = extract_text_from_file(uploaded_file)
+    # A rerun of the script with the same upload keeps its job instead of submitting the form again
+    file_hash = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    if st.session_state.get("file_hash") != file_hash:
+        try:
+            st.query_params["job_id"] = submit_form(uploaded_file)
+            st.session_state.file_hash = file_hash
+        except requests.RequestException as e:
+            # The hash is not kept, the next rerun submits the form again
+            st.error(f"The extraction service is not available, please try again: {e}")
 
-    st.subheader("OCR Text Preview")
-    st.text_area("OCR Output", ocr_text, height=200)
+# The job id is kept in the URL, a browser refresh shows the same job without running it again
+job_id = st.query_params.get("job_id")
+if job_id:
+    try:
+        with st.spinner("Processing OCR and extracting fields using GPT..."):
+            job = wait_for_job(job_id)
+    except requests.RequestException as e:
+        st.error(f"The extraction service is not available, please refresh the page to check the job again: {e}")
+        st.stop()
 
-    with st.spinner("Extracting fields using GPT..."):
-        extracted_json = extract_fields_with_gpt(ocr_text)
+    if job is None:
+        st.warning("The extraction job was not found, please upload the form again.")
+    elif job["status"] == "failed":
+        st.error(f"Extraction failed after {job['attempts']} attempts: {job['error']}")
+    else:
+        st.subheader("OCR Text Preview")
+        st.text_area("OCR Output", job["result"]["ocr_text"], height=200)
 
-    st.subheader("Extracted JSON")
-    st.json(extracted_json)
+        st.subheader("Extracted JSON")
+        validation_errors = job["result"].get("validation_errors")
+        if validation_errors:
+            st.warning("These fields were read but are not valid, please check them:\n" +
+                       "\n".join(f"- {field}: {error}" for field, error in validation_errors.items()))
+        st.json(job["result"]["result"])
@@ -1,7 +1,13 @@
 import json
+import logging
+import re
 
+from azure.ai.formrecognizer import AnalyzeResult
 from langchain.prompts import PromptTemplate
 from langchain_openai import AzureChatOpenAI
+from pydantic import ValidationError
+
+from app.models import Form283, empty_form
 from config import AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_KEY, AZURE_API_VERSION, OPENAI_ENGINE
 
 llm = AzureChatOpenAI(
@@ -12,14 +18,161 @@ llm = AzureChatOpenAI(
     temperature=0,
 )
 
+# Selection marks are written by the layout model as these words in the content
+SELECTED_MARK = ":selected:"
+UNSELECTED_MARK = ":unselected:"
+_SPACES_RE = re.compile(r"[ \t]+")
+_SEPARATORS = set(" \t:-")
+
+# Number of rounds that re-ask GPT only for the invalid or missing fields before they are left empty
+MAX_REPAIR_ATTEMPTS = 2
+_MISSING = object()
+
+REPAIR_PROMPT_TEMPLATE = PromptTemplate(
+    input_variables=['fields', 'ocr_text'],
+    template="""
+    You are an assistant that extracts structured data from National Insurance forms (ביטוח לאומי).
+    These fields extracted from the OCR text below are missing or invalid:
+    {fields}
+
+    Read the OCR text again and return a valid JSON object with only these fields, using the field names above as keys.
+    Dates are objects with "day", "month" and "year", every other value is a string.
+    If a field is not available, return it as an empty string.
+
+    OCR TEXT:
+    {ocr_text}
 
-def extract_fields_with_gpt(ocr_text: str) -> dict:
+    """
+)
+
+
+def _compact_text(text: str) -> str:
+    text = (text or "").replace(SELECTED_MARK, "[X]").replace(UNSELECTED_MARK, "[ ]")
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def _is_covered(content: str, spans, covered: set) -> bool:
+    """
+    This function is used to check if a line is already part of the key-value pairs or tables,
+    the separators between a key and its value do not count.
+    """
+    return bool(spans) and all(offset in covered or content[offset] in _SEPARATORS
+                               for span in spans for offset in range(span.offset, span.offset + span.length))
+
+
+def build_prompt_input(result: AnalyzeResult) -> str:
+    """
+    This function is used to build a compact text of the form from the layout result, to send to GPT instead of
+    the raw OCR content: the key-value pairs, the table rows and only the lines that are not part of them.
+    Checkboxes are written as [X] (selected) and [ ] (not selected), lines that hold only empty checkboxes are dropped.
+    Args:
+        result: the layout result of the form
+
+    Returns: the text of the form, grouped in sections
+    """
+    covered = set()
+    pairs = []
+    for pair in result.key_value_pairs or []:
+        key = _compact_text(pair.key.content if pair.key else "")
+        if not key:
+            continue
+        value = _compact_text(pair.value.content if pair.value else "")
+        pairs.append(f"{key}: {value}")
+        for element in (pair.key, pair.value):
+            for span in element.spans if element else []:
+                covered.update(range(span.offset, span.offset + span.length))
+
+    rows = []
+    for table in result.tables or []:
+        cells_by_row = {}
+        for cell in table.cells:
+            cells_by_row.setdefault(cell.row_index, []).append((cell.column_index, _compact_text(cell.content)))
+        for _, cells in sorted(cells_by_row.items()):
+            texts = [text for _, text in sorted(cells)]
+            if any(texts):
+                rows.append(" | ".join(texts))
+        for span in table.spans:
+            covered.update(range(span.offset, span.offset + span.length))
+
+    lines = []
+    for page in result.pages or []:
+        for line in page.lines or []:
+            text = _compact_text(line.content)
+            if not text.replace("[ ]", "").strip() or _is_covered(result.content, line.spans, covered):
+                continue
+            lines.append(text)
+
+    sections = [("KEY-VALUE PAIRS", pairs), ("TABLES", rows), ("TEXT", lines)]
+    compact = "\n\n".join(f"{title}:\n" + "\n".join(items) for title, items in sections if items)
+    return compact or _compact_text(result.content)
+
+
+def _get_path(data: dict, path: str):
+    for key in path.split("."):
+        if not isinstance(data, dict) or key not in data:
+            return _MISSING
+        data = data[key]
+    return data
+
+
+def _set_path(data: dict, path: str, value):
+    *parents, last = path.split(".")
+    for key in parents:
+        if not isinstance(data.get(key), dict):
+            data[key] = {}
+        data = data[key]
+    data[last] = value
+
+
+def get_invalid_fields(data: dict) -> dict:
+    """
+    This function is used to validate an extraction against the form 283 schema.
+    Args:
+        data: the JSON returned by GPT
+
+    Returns: Dict[dotted field name, error message] of the invalid or missing fields, empty when the data is valid
+    """
+    try:
+        Form283.model_validate(data)
+        return {}
+    except ValidationError as e:
+        return {".".join(str(part) for part in error["loc"][:2]): error["msg"].removeprefix("Value error, ")
+                for error in e.errors()}
+
+
+def _repair_fields(data: dict, invalid_fields: dict, ocr_text: str) -> dict:
+    """
+    This function is used to re-ask GPT only for the invalid or missing fields and merge the answers into the data.
+    """
+    lines = []
+    for path, message in invalid_fields.items():
+        value = _get_path(data, path)
+        current = "missing" if value is _MISSING else f"{json.dumps(value, ensure_ascii=False)} is invalid: {message}"
+        lines.append(f"- {path}: {current}")
+    prompt = REPAIR_PROMPT_TEMPLATE.format(fields="\n    ".join(lines), ocr_text=ocr_text)
+    response = llm.bind(response_format={"type": "json_object"}).invoke([{"role": "user", "content": prompt}])
+    try:
+        answer = json.loads(response.content)
+    except json.JSONDecodeError:
+        logging.warning("Cannot load the repair response: %s", response.content)
+        return data
+    for path in invalid_fields:
+        if isinstance(answer, dict) and path in answer:
+            _set_path(data, path, answer[path])
+    return data
+
+
+def extract_fields_with_gpt(ocr_text: str) -> tuple:
     """
     This function is used to extract the relevant fields with GPT.
+    The completion is generated in JSON mode and validated against the form 283 schema, invalid or missing fields
+    (ID check digit, dates, phone numbers...) are re-asked alone instead of repeating the whole extraction.
+    Fields still invalid after MAX_REPAIR_ATTEMPTS keep the value that was read and are reported with their error.
     Args:
-        ocr_text: Extracted data from the OCR process.
+        ocr_text: Extracted data from the OCR process, the output of build_prompt_input.
 
-    Returns: JSON of the relevant data
+    Returns: tuple of the JSON of the relevant data and Dict[dotted field name, error message] of the fields
+        that are still invalid
 
     """
     # prompt_template = """
@@ -89,6 +242,7 @@ def extract_fields_with_gpt(ocr_text: str) -> dict:
         template="""
     You are an assistant that extracts structured data from National Insurance forms (ביטוח לאומי).
     Based on the following OCR text, return the result as a valid JSON **without any explanation or formatting**.
+    The OCR text holds the key-value pairs, table rows and other text lines of the form, checkboxes are marked [X] when selected and [ ] otherwise.
 
     Return only this structure:
     {{
@@ -149,7 +303,36 @@ def extract_fields_with_gpt(ocr_text: str) -> dict:
     """
     )
 
-    response = llm.invoke([{"role": "user", "content": prompt_template.format(ocr_text=ocr_text)}])
+    json_llm = llm.bind(response_format={"type": "json_object"})
+    response = json_llm.invoke([{"role": "user", "content": prompt_template.format(ocr_text=ocr_text)}])
+
+    try:
+        data = json.loads(response.content)
+    except json.JSONDecodeError:
+        logging.warning("Cannot load the extraction response, re-asking every field: %s", response.content)
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+
+    for _ in range(MAX_REPAIR_ATTEMPTS):
+        invalid_fields = get_invalid_fields(data)
+        if not invalid_fields:
+            break
+        logging.info("Re-asking %d invalid or missing fields: %s", len(invalid_fields), ", ".join(invalid_fields))
+        data = _repair_fields(data, invalid_fields, ocr_text)
+
+    invalid_fields = get_invalid_fields(data)
+    if not invalid_fields:
+        return Form283.model_validate(data).model_dump(), {}
 
-    json_output = json.loads(response.content)
-    return json_output
+    logging.warning("Fields still invalid after %d repairs: %s", MAX_REPAIR_ATTEMPTS, invalid_fields)
+    # The rest of the form is validated without the invalid fields, which then get back the value that was read
+    empty = empty_form()
+    raw_values = {path: _get_path(data, path) for path in invalid_fields}
+    for path in invalid_fields:
+        _set_path(data, path, _get_path(empty, path))
+    json_output = Form283.model_validate(data).model_dump()
+    for path, value in raw_values.items():
+        if value is not _MISSING and value is not None:
+            _set_path(json_output, path, value)
+    return json_output, invalid_fields
@@ -0,0 +1,223 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from config import JOB_MAX_ATTEMPTS, JOB_RETRY_SECONDS, JOBS_DIR
+
+# One row per submitted document, the file itself is kept next to the database until the job ends
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, next_attempt_at, created_at);
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINAL_STATUSES = (SUCCEEDED, FAILED)
+
+
+class JobQueue:
+    """
+    Persistent queue of extraction jobs in a local SQLite file.
+    Jobs survive a restart of the service: the jobs that were running when the process stopped are queued again.
+    """
+
+    def __init__(self, jobs_dir=JOBS_DIR, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 retry_seconds: float = JOB_RETRY_SECONDS):
+        self.jobs_dir = Path(jobs_dir)
+        self.files_dir = self.jobs_dir / "files"
+        self.files_dir.mkdir(parents=True, exist_ok=True)
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self._connection = sqlite3.connect(str(self.jobs_dir / "jobs.sqlite"), check_same_thread=False,
+                                           isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        # Notified when a job becomes queued, idle workers wait on it
+        self.changed = threading.Condition(self._lock)
+
+    def recover(self) -> int:
+        """
+        This function is used to queue again the jobs left running by a previous process.
+
+        Returns: number of recovered jobs
+        """
+        with self._lock:
+            cursor = self._connection.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?",
+                                              (QUEUED, time.time(), RUNNING))
+            self.changed.notify_all()
+        return cursor.rowcount
+
+    def submit(self, file_name: str, content: bytes) -> str:
+        """
+        This function is used to store a document and queue its extraction.
+        Args:
+            file_name: original name of the uploaded file, its extension selects how it is read
+            content: the file content
+
+        Returns: the job id
+        """
+        job_id = uuid.uuid4().hex
+        file_path = self.files_dir / f"{job_id}{Path(file_name).suffix.lower()}"
+        file_path.write_bytes(content)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO jobs (id, file_name, file_path, status, max_attempts, next_attempt_at, created_at, "
+                "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, file_name, str(file_path), QUEUED, self.max_attempts, now, now, now))
+            self.changed.notify_all()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def claim(self) -> Optional[dict]:
+        """
+        This function is used to take the oldest queued job that is due and mark it running.
+
+        Returns: the job, None when no job is due
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT * FROM jobs WHERE status = ? AND next_attempt_at <= ? ORDER BY created_at LIMIT 1",
+                (QUEUED, now)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                                     (RUNNING, now, row["id"]))
+        job = self._to_dict(row)
+        job["status"] = RUNNING
+        job["attempts"] += 1
+        return job
+
+    def next_due_in(self) -> Optional[float]:
+        """
+        Returns: seconds until the next queued job is due, None when the queue is empty
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT MIN(next_attempt_at) FROM jobs WHERE status = ?",
+                                           (QUEUED,)).fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def complete(self, job: dict, result: dict):
+        self._finish(job, SUCCEEDED, result=json.dumps(result, ensure_ascii=False))
+
+    def fail(self, job: dict, error: str):
+        """
+        This function is used to record a failed attempt, the job is queued again with a growing delay
+        until it used all its attempts.
+        """
+        if job["attempts"] >= job["max_attempts"]:
+            self._finish(job, FAILED, error=error)
+            return
+        delay = self.retry_seconds * 2 ** (job["attempts"] - 1)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, next_attempt_at = ?, updated_at = ?, error = ? WHERE id = ?",
+                (QUEUED, now + delay, now, error, job["id"]))
+            self.changed.notify_all()
+        logging.warning("Job %s failed (attempt %d/%d), retry in %.0fs: %s", job["id"], job["attempts"],
+                        job["max_attempts"], delay, error)
+
+    def _finish(self, job: dict, status: str, result: str = None, error: str = None):
+        with self._lock:
+            self._connection.execute("UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                                     (status, result, error, time.time(), job["id"]))
+        # The document is not needed anymore, the OCR cache keeps its layout
+        Path(job["file_path"]).unlink(missing_ok=True)
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class JobWorkerPool:
+    """
+    Bounded pool of worker threads that run the queued jobs, at most `workers` documents are processed at once.
+    """
+
+    def __init__(self, queue: JobQueue, handler: Callable[[str], dict], workers: int):
+        """
+        Args:
+            queue: the job queue
+            handler: function that processes the file of a job and returns its result, raises on failure
+            workers: maximum number of jobs running in parallel
+        """
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        recovered = self.queue.recover()
+        if recovered:
+            logging.info("Queued again %d jobs left running by the previous process", recovered)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        """
+        This function is used to stop taking new jobs and wait for the running ones.
+        """
+        self._stop.set()
+        with self.queue.changed:
+            self.queue.changed.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            job = self.queue.claim()
+            if job is None:
+                due_in = self.queue.next_due_in()
+                with self.queue.changed:
+                    self.queue.changed.wait(due_in if due_in is not None else 1.0)
+                continue
+            try:
+                result = self.handler(job["file_path"])
+            except Exception as e:
+                logging.error("Job %s failed: %s", job["id"], traceback.format_exc())
+                self.queue.fail(job, f"{type(e).__name__}: {e}")
+            else:
+                self.queue.complete(job, result)
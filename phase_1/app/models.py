@@ -0,0 +1,168 @@
+import datetime
+import re
+
+from pydantic import BaseModel, ConfigDict, field_validator, model_validator
+
+_NON_DIGITS_RE = re.compile(r"\D")
+_TIME_RE = re.compile(r"^([01]?\d|2[0-3]):[0-5]\d$")
+
+
+def _digits(value: str) -> str:
+    return _NON_DIGITS_RE.sub("", value or "")
+
+
+def _phone_digits(value: str) -> str:
+    # International numbers (+972 50-1234567, 00972-3-...) are written in the local format, with the leading 0
+    digits = _digits(value)
+    for country_code in ("00972", "972"):
+        if digits.startswith(country_code):
+            digits = digits[len(country_code):]
+            return digits if digits.startswith("0") else "0" + digits
+    return digits
+
+
+def is_valid_israeli_id(value: str) -> bool:
+    """
+    This function is used to check the check digit of an Israeli ID number.
+    Args:
+        value: 9 digits ID number
+
+    Returns: True when the check digit matches
+    """
+    if len(value) != 9 or not value.isdigit():
+        return False
+    total = 0
+    for i, digit in enumerate(value):
+        product = int(digit) * (1 + i % 2)
+        total += product - 9 if product > 9 else product
+    return total % 10 == 0
+
+
+class FormModel(BaseModel):
+    # GPT sometimes writes numbers (years, house numbers) as JSON numbers and unknown values as null
+    model_config = ConfigDict(coerce_numbers_to_str=True, str_strip_whitespace=True)
+
+    @model_validator(mode='before')
+    @classmethod
+    def replace_nulls(cls, data):
+        if isinstance(data, dict):
+            return {key: "" if value is None else value for key, value in data.items()}
+        return data
+
+
+class DateField(FormModel):
+    day: str
+    month: str
+    year: str
+
+    @field_validator('day')
+    def validate_day(cls, v):
+        if v and (not v.isdigit() or not 1 <= int(v) <= 31):
+            raise ValueError('Day must be a number between 1 and 31')
+        return v.zfill(2) if v else v
+
+    @field_validator('month')
+    def validate_month(cls, v):
+        if v and (not v.isdigit() or not 1 <= int(v) <= 12):
+            raise ValueError('Month must be a number between 1 and 12')
+        return v.zfill(2) if v else v
+
+    @field_validator('year')
+    def validate_year(cls, v):
+        if v and (not v.isdigit() or len(v) != 4):
+            raise ValueError('Year must have 4 digits')
+        return v
+
+    @model_validator(mode='after')
+    def validate_date(self):
+        if self.day and self.month and self.year:
+            try:
+                datetime.date(int(self.year), int(self.month), int(self.day))
+            except ValueError:
+                raise ValueError(f'{self.day}/{self.month}/{self.year} is not a valid date')
+        return self
+
+
+class Address(FormModel):
+    street: str
+    houseNumber: str
+    entrance: str
+    apartment: str
+    city: str
+    postalCode: str
+    poBox: str
+
+    @field_validator('postalCode')
+    def validate_postal_code(cls, v):
+        digits = _digits(v)
+        if v and len(digits) not in (5, 7):
+            raise ValueError('Postal code must have 5 or 7 digits')
+        return digits if v else v
+
+
+class MedicalInstitutionFields(FormModel):
+    healthFundMember: str
+    natureOfAccident: str
+    medicalDiagnoses: str
+
+
+class Form283(FormModel):
+    lastName: str
+    firstName: str
+    idNumber: str
+    gender: str
+    dateOfBirth: DateField
+    address: Address
+    landlinePhone: str
+    mobilePhone: str
+    jobType: str
+    dateOfInjury: DateField
+    timeOfInjury: str
+    accidentLocation: str
+    accidentAddress: str
+    accidentDescription: str
+    injuredBodyPart: str
+    signature: str
+    formFillingDate: DateField
+    formReceiptDateAtClinic: DateField
+    medicalInstitutionFields: MedicalInstitutionFields
+
+    @field_validator('idNumber')
+    def validate_id_number(cls, v):
+        if not v:
+            return v
+        digits = _digits(v)
+        if not 5 <= len(digits) <= 9 or not is_valid_israeli_id(digits.zfill(9)):
+            raise ValueError('ID number must be 9 digits with a valid check digit')
+        return digits.zfill(9)
+
+    @field_validator('mobilePhone')
+    def validate_mobile_phone(cls, v):
+        digits = _phone_digits(v)
+        if v and (len(digits) != 10 or not digits.startswith("05")):
+            raise ValueError('Mobile phone must be 10 digits starting with 05')
+        return digits if v else v
+
+    @field_validator('landlinePhone')
+    def validate_landline_phone(cls, v):
+        digits = _phone_digits(v)
+        if v and (len(digits) not in (9, 10) or not digits.startswith("0")):
+            raise ValueError('Landline phone must be 9 or 10 digits starting with 0')
+        return digits if v else v
+
+    @field_validator('timeOfInjury')
+    def validate_time(cls, v):
+        if v and not _TIME_RE.match(v.strip()):
+            raise ValueError('Time must be in HH:MM format')
+        return v.strip()
+
+
+def empty_form() -> dict:
+    """
+    This function is used to build the form 283 JSON with every field empty.
+    """
+    def empty(model):
+        return {name: empty(field.annotation) if isinstance(field.annotation, type) and issubclass(field.annotation, BaseModel)
+                else "" for name, field in model.model_fields.items()}
+
+    return empty(Form283)
@@ -1,8 +1,18 @@
 
-from azure.ai.formrecognizer import DocumentAnalysisClient
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from azure.ai.formrecognizer import AnalysisFeature, AnalyzeResult, DocumentAnalysisClient
 from azure.core.credentials import AzureKeyCredential
 
-from config import AZURE_FORM_ENDPOINT, AZURE_FORM_KEY
+from app.ocr_cache import OCR_CACHE
+from config import AZURE_FORM_ENDPOINT, AZURE_FORM_KEY, OCR_PAGE_WORKERS
+
+OCR_MODEL_ID = "prebuilt-layout"
+# Key-value pairs are an add-on of the layout model, they are the main input of the field extraction
+OCR_FEATURES = [AnalysisFeature.KEY_VALUE_PAIRS]
 
 # Connect to Azure document form recognizer by the specifiy credentials
 client = DocumentAnalysisClient(
@@ -11,6 +21,116 @@ client = DocumentAnalysisClient(
 )
 
 
+def split_pdf_pages(file_bytes: bytes) -> List[bytes]:
+    """
+    This function is used to split a multi-page PDF into one PDF per page.
+    Images, single page files and files pypdf cannot read are returned as they are.
+    Args:
+        file_bytes: the file content
+
+    Returns: list of the page files, in page order
+    """
+    if not file_bytes.startswith(b"%PDF"):
+        return [file_bytes]
+    try:
+        from pypdf import PdfReader, PdfWriter
+
+        reader = PdfReader(io.BytesIO(file_bytes))
+        if len(reader.pages) <= 1:
+            return [file_bytes]
+        pages = []
+        for page in reader.pages:
+            writer = PdfWriter()
+            writer.add_page(page)
+            page_file = io.BytesIO()
+            writer.write(page_file)
+            pages.append(page_file.getvalue())
+        return pages
+    except Exception:
+        logging.warning("Cannot split the PDF into pages, analyzing it in one request", exc_info=True)
+        return [file_bytes]
+
+
+def _shift_offsets(value, content_offset: int, page_offset: int):
+    """
+    This function is used to move the content spans and page numbers of a single page result to their place
+    in the merged document.
+    """
+    if isinstance(value, list):
+        return [_shift_offsets(item, content_offset, page_offset) for item in value]
+    if not isinstance(value, dict):
+        return value
+    shifted = {}
+    for key, item in value.items():
+        if key in ("span", "spans") and item is not None:
+            spans = [item] if key == "span" else item
+            spans = [{**span, "offset": span["offset"] + content_offset} for span in spans]
+            shifted[key] = spans[0] if key == "span" else spans
+        elif key == "page_number" and item is not None:
+            shifted[key] = item + page_offset
+        else:
+            shifted[key] = _shift_offsets(item, content_offset, page_offset)
+    return shifted
+
+
+def merge_page_results(results: List[AnalyzeResult]) -> AnalyzeResult:
+    """
+    This function is used to merge the layout results of the pages of a document, in page order,
+    into the result the service returns for the whole document.
+    Args:
+        results: layout result of every page
+
+    Returns: the merged layout result
+    """
+    if len(results) == 1:
+        return results[0]
+    merged = {"api_version": results[0].api_version, "model_id": results[0].model_id, "content": ""}
+    page_offset = 0
+    for result in results:
+        page_dict = result.to_dict()
+        content_offset = len(merged["content"]) + (1 if merged["content"] else 0)
+        merged["content"] += ("\n" if merged["content"] else "") + page_dict.pop("content", "")
+        page_dict = _shift_offsets(page_dict, content_offset, page_offset)
+        for key, value in page_dict.items():
+            if isinstance(value, list):
+                merged.setdefault(key, []).extend(value)
+        page_offset += len(result.pages)
+    return AnalyzeResult.from_dict(merged)
+
+
+def get_cache_model_id() -> str:
+    return "+".join([OCR_MODEL_ID, *sorted(feature.value for feature in OCR_FEATURES)])
+
+
+def _analyze_bytes(file_bytes: bytes) -> AnalyzeResult:
+    poller = client.begin_analyze_document(OCR_MODEL_ID, document=file_bytes, features=OCR_FEATURES)
+    return poller.result()
+
+
+def analyze_document(file) -> AnalyzeResult:
+    """
+    This function is used to run the layout model on a given file, results are cached by the file content
+    so the same document is sent to Document Intelligence only once.
+    Multi-page PDFs are split and their pages are analyzed in parallel, the results are merged in page order.
+    Args:
+        file: PDF/JPG file object or bytes
+
+    Returns: the full layout result
+    """
+    file_bytes = file if isinstance(file, bytes) else file.read()
+    cache_key = OCR_CACHE.make_key(file_bytes, get_cache_model_id())
+    result = OCR_CACHE.get(cache_key)
+    if result is None:
+        pages = split_pdf_pages(file_bytes)
+        if len(pages) == 1:
+            result = _analyze_bytes(file_bytes)
+        else:
+            with ThreadPoolExecutor(max_workers=min(OCR_PAGE_WORKERS, len(pages))) as executor:
+                result = merge_page_results(list(executor.map(_analyze_bytes, pages)))
+        OCR_CACHE.set(cache_key, result)
+    return result
+
+
 def extract_text_from_file(file) -> str:
     """
     This function extract the data from a given file.
@@ -19,7 +139,4 @@ def extract_text_from_file(file) -> str:
 
     Returns: string that represent the result of the OCR process
     """
-    poller = client.begin_analyze_document("prebuilt-layout", document=file)
-    result = poller.result()
-
-    return result.content
+    return analyze_document(file).content
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from azure.ai.formrecognizer import AnalyzeResult
+
+from config import OCR_CACHE_DIR, OCR_CACHE_MAX_BYTES
+
+
+class OcrCache:
+    """
+    Content addressed on-disk cache of Document Intelligence results.
+    Entries are keyed by the SHA-256 of the model id and the file bytes and hold the full layout result,
+    the least recently used entries are evicted once the cache grows above max_bytes.
+    Writes are atomic so the Streamlit UI and batch jobs can share one cache folder.
+    """
+
+    def __init__(self, cache_dir=OCR_CACHE_DIR, max_bytes: int = OCR_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(file_bytes: bytes, model_id: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(model_id.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(file_bytes)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[AnalyzeResult]:
+        path = self._path(key)
+        try:
+            result = AnalyzeResult.from_dict(json.loads(path.read_text(encoding="utf-8")))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logging.warning("Dropping unreadable OCR cache entry %s", path)
+            path.unlink(missing_ok=True)
+            return None
+        # Refresh the modification time, it is the recency used by the eviction
+        os.utime(path)
+        return result
+
+    def set(self, key: str, result: AnalyzeResult):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp_file:
+            json.dump(result.to_dict(), tmp_file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        This function is used to delete the least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        total_bytes = 0
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+
+
+# Global object
+OCR_CACHE = OcrCache()
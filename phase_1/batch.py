@@ -0,0 +1,217 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.extractor import build_prompt_input, extract_fields_with_gpt
+from app.ocr import analyze_document
+
+SUPPORTED_EXTENSIONS = {".pdf", ".jpg", ".jpeg"}
+
+
+def collect_input_files(input_dir=None, manifest=None) -> list:
+    """
+    This function is used to list the forms to process, either every supported file in a folder or the paths
+    written in a manifest file (one path per line, relative paths are resolved next to the manifest).
+    Args:
+        input_dir: folder of PDF/JPG forms
+        manifest: text file with a path in every line
+
+    Returns: sorted list of absolute paths
+    """
+    files = []
+    if input_dir:
+        files.extend(path for path in Path(input_dir).rglob("*") if path.suffix.lower() in SUPPORTED_EXTENSIONS)
+    if manifest:
+        manifest = Path(manifest)
+        for line in manifest.read_text(encoding="utf-8").splitlines():
+            line = line.strip()
+            if line and not line.startswith("#"):
+                path = Path(line)
+                files.append(path if path.is_absolute() else manifest.parent / path)
+    return sorted({str(path.resolve()) for path in files})
+
+
+def load_checkpoint(output_path: Path) -> set:
+    """
+    This function is used to read the results file of a previous run and return the files that already succeeded,
+    so a crashed run can resume without paying for them again. Failed files are retried.
+    Args:
+        output_path: JSONL results file
+
+    Returns: set of file paths that were completed
+    """
+    completed = set()
+    if not output_path.exists():
+        return completed
+    with output_path.open(encoding="utf-8") as results_file:
+        for line in results_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash in the middle of a write leaves a truncated last line, that file is processed again
+                continue
+            if record.get("status") == "ok":
+                completed.add(record["file"])
+    return completed
+
+
+def drop_partial_line(output_path: Path):
+    """
+    This function is used to cut the truncated last line a crash left in the results file,
+    so the first record of the resumed run starts on its own line.
+    """
+    if not output_path.exists():
+        return
+    with output_path.open("r+b") as results_file:
+        data = results_file.read()
+        if data and not data.endswith(b"\n"):
+            results_file.truncate(data.rfind(b"\n") + 1)
+
+
+def extract_form(path: str, include_text: bool = False) -> dict:
+    """
+    This function is used to run OCR and GPT field extraction on a single form and time every stage.
+    Args:
+        path: path of the PDF/JPG form
+        include_text: also return the OCR text sent to GPT
+
+    Returns: dict of the extracted fields ("result"), the fields that are still invalid ("validation_errors"),
+        the number of pages and the stage timings
+    """
+    record = {}
+    started = time.perf_counter()
+    with open(path, "rb") as form_file:
+        layout = analyze_document(form_file)
+    record["ocr_seconds"] = round(time.perf_counter() - started, 3)
+    record["pages"] = len(layout.pages)
+    ocr_text = build_prompt_input(layout)
+    if include_text:
+        record["ocr_text"] = ocr_text
+
+    extraction_started = time.perf_counter()
+    record["result"], record["validation_errors"] = extract_fields_with_gpt(ocr_text)
+    record["extraction_seconds"] = round(time.perf_counter() - extraction_started, 3)
+    return record
+
+
+def process_file(path: str) -> dict:
+    """
+    This function is used to extract a single form of the batch, errors are recorded instead of raised.
+    Args:
+        path: path of the PDF/JPG form
+
+    Returns: result record
+    """
+    record = {"file": path}
+    started = time.perf_counter()
+    try:
+        record.update(extract_form(path))
+        record["status"] = "ok"
+    except Exception as e:
+        logging.error("Failed to process %s: %s", path, traceback.format_exc())
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["total_seconds"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def _percentile(values: list, percentile: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percentile / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(records: list, wall_seconds: float, skipped: int) -> dict:
+    """
+    This function is used to aggregate the per file timings of a run.
+    Args:
+        records: result records of this run
+        wall_seconds: wall clock time of the run
+        skipped: files skipped because of the checkpoint
+
+    Returns: dict of aggregate throughput and latency numbers
+    """
+    succeeded = [record for record in records if record["status"] == "ok"]
+    totals = [record["total_seconds"] for record in records]
+    summary = {
+        "processed": len(records),
+        "succeeded": len(succeeded),
+        "failed": len(records) - len(succeeded),
+        "with_validation_errors": sum(1 for record in succeeded if record.get("validation_errors")),
+        "skipped": skipped,
+        "wall_seconds": round(wall_seconds, 3),
+        "files_per_minute": round(len(records) / wall_seconds * 60, 2) if wall_seconds else 0.0,
+        "total_seconds_p50": _percentile(totals, 50),
+        "total_seconds_p95": _percentile(totals, 95),
+    }
+    for stage in ("ocr_seconds", "extraction_seconds"):
+        stage_values = [record[stage] for record in succeeded]
+        summary[f"mean_{stage}"] = round(sum(stage_values) / len(stage_values), 3) if stage_values else 0.0
+    return summary
+
+
+def run_batch(files: list, output_path: Path, workers: int = 4) -> dict:
+    """
+    This function is used to process the forms concurrently with at most `workers` forms in flight,
+    every result is appended to the JSONL output as soon as it is ready.
+    Args:
+        files: paths of the forms
+        output_path: JSONL results file, also used as the checkpoint
+        workers: maximum number of forms processed in parallel
+
+    Returns: summary of the run
+    """
+    completed = load_checkpoint(output_path)
+    pending = [path for path in files if path not in completed]
+    skipped = len(files) - len(pending)
+    logging.info("%d files to process, %d already completed", len(pending), skipped)
+
+    records = []
+    started = time.perf_counter()
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    drop_partial_line(output_path)
+    with output_path.open("a", encoding="utf-8") as results_file, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_file, path): path for path in pending}
+        for future in as_completed(futures):
+            record = future.result()
+            records.append(record)
+            results_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            results_file.flush()
+            logging.info("[%d/%d] %s %s in %.2fs", len(records), len(pending), record["status"], record["file"],
+                         record["total_seconds"])
+
+    return summarize(records, time.perf_counter() - started, skipped)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract National Insurance form 283 fields from a batch of files.")
+    parser.add_argument("--input-dir", help="folder of PDF/JPG forms (searched recursively)")
+    parser.add_argument("--manifest", help="text file with one form path per line")
+    parser.add_argument("--output", required=True, help="JSONL results file, re-running with it resumes the batch")
+    parser.add_argument("--workers", type=int, default=4, help="number of forms processed in parallel")
+    parser.add_argument("--summary", help="optional JSON file for the throughput summary")
+    args = parser.parse_args()
+    if not args.input_dir and not args.manifest:
+        parser.error("one of --input-dir or --manifest is required")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    files = collect_input_files(args.input_dir, args.manifest)
+    summary = run_batch(files, Path(args.output), workers=max(1, args.workers))
+
+    print(json.dumps(summary, indent=2))
+    if args.summary:
+        Path(args.summary).write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI, HTTPException, UploadFile
+
+from app.jobs import FINAL_STATUSES, JobQueue, JobWorkerPool
+from batch import SUPPORTED_EXTENSIONS, extract_form
+from config import JOB_WORKERS
+
+# Longest time a client may wait for a job in one request, and how often the job is checked meanwhile
+MAX_WAIT_SECONDS = 60
+WAIT_POLL_SECONDS = 0.25
+
+# Global object
+JOB_QUEUE = JobQueue()
+
+
+def run_job(path: str) -> dict:
+    return extract_form(path, include_text=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    This function is used to start the worker threads, jobs queued before a restart are picked up again.
+    """
+    pool = JobWorkerPool(JOB_QUEUE, run_job, JOB_WORKERS)
+    pool.start()
+    yield
+    await asyncio.to_thread(pool.stop)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok", "jobs": await asyncio.to_thread(JOB_QUEUE.counts)}
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile):
+    """
+    This function is used to queue the extraction of an uploaded PDF/JPG form.
+
+    Returns: the job id and status, poll GET /jobs/{job_id} for the result
+    """
+    if Path(file.filename or "").suffix.lower() not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(status_code=415, detail=f"Supported files: {', '.join(sorted(SUPPORTED_EXTENSIONS))}")
+    content = await file.read()
+    job_id = await asyncio.to_thread(JOB_QUEUE.submit, file.filename, content)
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """
+    This function is used to get the status and result of a job.
+    Args:
+        job_id: id returned by POST /jobs
+        wait: seconds to wait for the job to end before answering (long polling), at most MAX_WAIT_SECONDS
+
+    Returns: the job, with the extraction result once it succeeded
+    """
+    deadline = time.monotonic() + min(max(wait, 0), MAX_WAIT_SECONDS)
+    job = await asyncio.to_thread(JOB_QUEUE.get, job_id)
+    while job is not None and job["status"] not in FINAL_STATUSES and time.monotonic() < deadline:
+        await asyncio.sleep(WAIT_POLL_SECONDS)
+        job = await asyncio.to_thread(JOB_QUEUE.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("file_path")
+    return job
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -5,7 +5,21 @@ import requests
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config import BACKEND_URL
+from phase_2.backend_client import BACKEND_CLIENT
+
+UNAVAILABLE_MESSAGE = "The service is not available right now, please try again in a moment."
+
+
+def stream_qa_answer(user_prompt, user_info):
+    """
+    This function is used to read the streamed QA answer from the backend and yield its tokens as they arrive.
+    """
+    try:
+        for event in BACKEND_CLIENT.stream_qa(user_prompt, user_info):
+            if event.get("type") in ("token", "error"):
+                yield event.get("content", "")
+    except requests.RequestException:
+        yield UNAVAILABLE_MESSAGE
 
 
 st.set_page_config(page_title="HMO Chatbot", layout="centered")
@@ -18,6 +32,8 @@ if "user_info" not in st.session_state:
     st.session_state.user_info = None
 if "phase" not in st.session_state:
     st.session_state.phase = "collect_data"
+if "session_id" not in st.session_state:
+    st.session_state.session_id = None
 
 # Display history
 for msg in st.session_state.messages:
@@ -33,10 +49,11 @@ if user_input:
             st.markdown(user_input)
 
         with st.spinner("Thinking..."):
-            response = requests.post(f"{BACKEND_URL}/chat", json={
-                "messages": st.session_state.messages,
-                "user_prompt": user_input
-            }).json()
+            try:
+                response = BACKEND_CLIENT.chat(st.session_state.session_id, user_input)
+            except requests.RequestException:
+                response = {"session_id": st.session_state.session_id, "content": UNAVAILABLE_MESSAGE}
+            st.session_state.session_id = response.get('session_id')
 
             res_content = response.get('content')
             st.session_state.messages.append({"role": "assistant", "content": res_content})
@@ -49,18 +66,13 @@ if user_input:
         if user_info.get('is_confirmed', False) and not missing_fields:
             st.session_state.phase = 'qa'
             st.session_state.user_info = user_info
+            # The backend gets ready for the QA phase while the user writes the first question
+            BACKEND_CLIENT.warm_up_qa(user_info)
     else:
         with st.chat_message("user"):
             st.markdown(user_input)
             st.session_state.messages.append({"role": "user", "content": user_input})
 
-        with st.spinner("Thinking..."):
-            response = requests.post(f"{BACKEND_URL}/qa", json={
-                "user_prompt": user_input,
-                "user_info": st.session_state.user_info,
-            }).json()
-
-            response_content = response.get('content')
         with st.chat_message("assistant"):
-            st.write(response_content)
+            response_content = st.write_stream(stream_qa_answer(user_input, st.session_state.user_info))
             st.session_state.messages.append({"role": "assistant", "content": response_content})
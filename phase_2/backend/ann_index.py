@@ -0,0 +1,108 @@
+import logging
+import math
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from config import (KB_INDEX_TYPE, KB_INDEX_QUANTIZATION, KB_HNSW_M, KB_HNSW_EF_SEARCH, KB_IVF_NLIST, KB_IVF_NPROBE,
+                    KB_PQ_M)
+
+if TYPE_CHECKING:
+    import faiss
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq")
+QUANTIZATIONS = ("none", "sq8", "pq")
+# k-means wants at least this many training vectors per centroid (IVF lists and PQ codes)
+MIN_POINTS_PER_CENTROID = 39
+
+
+def get_index_settings() -> dict:
+    """
+    This function is used to read the index type and its build settings from the configuration.
+    The search settings (efSearch, nprobe) are not part of it, they apply without rebuilding the index.
+    """
+    settings = {"type": KB_INDEX_TYPE, "quantization": KB_INDEX_QUANTIZATION}
+    if KB_INDEX_TYPE == "ivfpq":
+        settings = {"type": "ivf", "quantization": "pq"}
+    if settings["type"] not in INDEX_TYPES or settings["quantization"] not in QUANTIZATIONS:
+        raise ValueError(f"Unknown index {KB_INDEX_TYPE}/{KB_INDEX_QUANTIZATION}, "
+                         f"types are {INDEX_TYPES} and quantizations are {QUANTIZATIONS}")
+    if settings["type"] == "hnsw":
+        settings["hnsw_m"] = KB_HNSW_M
+    if settings["type"] == "ivf":
+        settings["ivf_nlist"] = KB_IVF_NLIST
+    if settings["quantization"] == "pq":
+        settings["pq_m"] = KB_PQ_M
+    return settings
+
+
+def get_search_settings() -> dict:
+    return {"efSearch": KB_HNSW_EF_SEARCH, "nprobe": KB_IVF_NPROBE}
+
+
+def _pq_code(dimension: int, size: int, pq_m: int) -> str:
+    # The sub-vectors must split the dimension evenly, and small corpora cannot train 256 centroids per sub-vector
+    pq_m = max(m for m in range(1, min(pq_m, dimension) + 1) if dimension % m == 0)
+    nbits = max(1, min(8, int(math.log2(max(2, size // MIN_POINTS_PER_CENTROID)))))
+    return f"PQ{pq_m}x{nbits}"
+
+
+def get_factory_string(settings: dict, dimension: int, size: int) -> str:
+    """
+    This function is used to translate the index settings into a faiss index factory string.
+    Args:
+        settings: index settings, see get_index_settings
+        dimension: dimension of the embeddings
+        size: number of vectors the index is trained on
+
+    Returns: faiss index factory string
+    """
+    index_type = settings["type"]
+    quantization = settings["quantization"]
+    if index_type == "ivfpq":
+        index_type, quantization = "ivf", "pq"
+    codes = {"none": "Flat", "sq8": "SQ8"}.get(quantization) or _pq_code(dimension, size, settings.get("pq_m", KB_PQ_M))
+
+    if index_type == "flat":
+        return codes
+    if index_type == "hnsw":
+        hnsw = f"HNSW{settings.get('hnsw_m', KB_HNSW_M)}"
+        return hnsw if codes == "Flat" else f"{hnsw}_{codes}"
+    nlist = settings.get("ivf_nlist") or int(4 * math.sqrt(size))
+    nlist = max(1, min(nlist, size // MIN_POINTS_PER_CENTROID))
+    return f"IVF{nlist},{codes}"
+
+
+def build_index(embeddings: np.ndarray, settings: dict) -> "faiss.Index":
+    """
+    This function is used to build and fill the FAISS index of the knowledge base embeddings.
+    Args:
+        embeddings: float32 matrix with one row per chunk, in chunk store order
+        settings: index settings, see get_index_settings
+
+    Returns: the trained index holding every embedding
+    """
+    import faiss
+
+    factory_string = get_factory_string(settings, embeddings.shape[1], len(embeddings))
+    logging.info("Building a %s FAISS index of %d vectors", factory_string, len(embeddings))
+    index = faiss.index_factory(embeddings.shape[1], factory_string)
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+
+def apply_search_settings(index: "faiss.Index", search_settings: dict = None) -> "faiss.Index":
+    """
+    This function is used to set the query time parameters the index type has (HNSW efSearch, IVF nprobe).
+    """
+    import faiss
+
+    search_settings = search_settings or get_search_settings()
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = search_settings["efSearch"]
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None:
+        ivf_index.nprobe = min(search_settings["nprobe"], ivf_index.nlist)
+    return index
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from phase_2.backend.hmo_plans import normalize_hmo, normalize_tier
+from phase_2.backend.metrics import CACHE_LOOKUPS
+from config import (QA_CACHE_BACKEND, QA_CACHE_REDIS_URL, QA_CACHE_MAX_ENTRIES, QA_CACHE_TTL_SECONDS,
+                    QA_CACHE_SEMANTIC, QA_CACHE_SEMANTIC_THRESHOLD)
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """
+    This function is used to normalize a question so trivially different phrasings share one cache entry.
+    Args:
+        question: the raw user question
+
+    Returns: lower cased question without punctuation and repeated spaces
+    """
+    text = unicodedata.normalize("NFKC", question or "").casefold()
+    text = _PUNCTUATION_RE.sub(" ", text)
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+class InMemoryCacheBackend:
+    """
+    In-process LRU cache with a per entry TTL, used by default and as the stand-in for Redis.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCacheBackend:
+    """
+    Redis (or any Redis compatible server) cache, the size bound is enforced by the server maxmemory-policy (allkeys-lru).
+    """
+
+    def __init__(self, url: str, ttl_seconds: float, prefix: str = "qa-cache:"):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url, decode_responses=True)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, value: str):
+        await self.client.set(self.prefix + key, value, ex=int(self.ttl_seconds))
+
+    async def clear(self):
+        async for key in self.client.scan_iter(match=self.prefix + "*"):
+            await self.client.delete(key)
+
+
+class AnswerCache:
+    """
+    Cache of QA answers keyed by the normalized question, the user's HMO, membership tier and the knowledge base
+    index version. A new index version never hits the answers of the previous one.
+    """
+
+    def __init__(self, backend, semantic: bool = False, semantic_threshold: float = 0.95, max_entries: int = 1000):
+        self.backend = backend
+        self.semantic = semantic
+        self.semantic_threshold = semantic_threshold
+        self.max_entries = max_entries
+        self.index_version = None
+        # Partition (index version, hmo, tier) -> OrderedDict[cache key, normalized query embedding]
+        self._embeddings = {}
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _partition(hmo_name: str, membership_tier: str) -> tuple:
+        return (normalize_hmo(hmo_name) or normalize_question(hmo_name),
+                normalize_tier(membership_tier) or normalize_question(membership_tier))
+
+    def make_key(self, question: str, hmo_name: str, membership_tier: str, index_version: str = None) -> str:
+        hmo, tier = self._partition(hmo_name, membership_tier)
+        digest = hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+        return f"{index_version or self.index_version}:{hmo}:{tier}:{digest}"
+
+    async def set_index_version(self, index_version: str):
+        """
+        This function is used to invalidate the cache when the knowledge base index changes.
+        """
+        if index_version == self.index_version:
+            return
+        if self.index_version is not None:
+            logging.info("Knowledge base index changed, clearing the QA answer cache.")
+            await self.backend.clear()
+        self.index_version = index_version
+        self._embeddings.clear()
+
+    async def get(self, question: str, hmo_name: str, membership_tier: str) -> Optional[str]:
+        value = await self.backend.get(self.make_key(question, hmo_name, membership_tier))
+        CACHE_LOOKUPS.inc(cache="answer", result="miss" if value is None else "hit")
+        if value is None:
+            if not self.semantic:
+                self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    async def get_similar(self, query_embedding: List[float], hmo_name: str, membership_tier: str) -> Optional[str]:
+        """
+        This function is used to find a cached answer of a semantically equivalent question by reusing its query embedding.
+        Args:
+            query_embedding: the embedding of the new question
+            hmo_name: user HMO
+            membership_tier: user membership tier
+
+        Returns: cached answer or None
+        """
+        if not self.semantic:
+            return None
+        entries = self._embeddings.get((self.index_version, *self._partition(hmo_name, membership_tier)))
+        if not entries:
+            self._semantic_miss()
+            return None
+
+        keys = list(entries.keys())
+        matrix = np.vstack(list(entries.values()))
+        scores = matrix @ self._unit(query_embedding)
+        best = int(np.argmax(scores))
+        if scores[best] < self.semantic_threshold:
+            self._semantic_miss()
+            return None
+
+        value = await self.backend.get(keys[best])
+        if value is None:
+            entries.pop(keys[best], None)
+            self._semantic_miss()
+            return None
+        self.semantic_hits += 1
+        CACHE_LOOKUPS.inc(cache="semantic_answer", result="hit")
+        return json.loads(value)
+
+    def _semantic_miss(self):
+        self.misses += 1
+        CACHE_LOOKUPS.inc(cache="semantic_answer", result="miss")
+
+    async def set(self, question: str, hmo_name: str, membership_tier: str, answer: str, query_embedding=None,
+                  index_version: str = None):
+        """
+        This function is used to cache an answer. An answer built on an index version that was replaced meanwhile
+        (a request that was in flight during a reload) is dropped.
+        """
+        if index_version is not None and index_version != self.index_version:
+            return
+        key = self.make_key(question, hmo_name, membership_tier)
+        await self.backend.set(key, json.dumps(answer, ensure_ascii=False))
+        if self.semantic and query_embedding is not None:
+            partition = self._embeddings.setdefault((self.index_version, *self._partition(hmo_name, membership_tier)),
+                                                    OrderedDict())
+            partition[key] = self._unit(query_embedding)
+            while len(partition) > self.max_entries:
+                partition.popitem(last=False)
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def create_answer_cache() -> AnswerCache:
+    """
+    This function is used to build the answer cache from the configuration.
+
+    Returns: AnswerCache
+    """
+    if QA_CACHE_BACKEND == "redis":
+        backend = RedisCacheBackend(QA_CACHE_REDIS_URL, QA_CACHE_TTL_SECONDS)
+    else:
+        backend = InMemoryCacheBackend(QA_CACHE_MAX_ENTRIES, QA_CACHE_TTL_SECONDS)
+    return AnswerCache(backend, semantic=QA_CACHE_SEMANTIC, semantic_threshold=QA_CACHE_SEMANTIC_THRESHOLD,
+                       max_entries=QA_CACHE_MAX_ENTRIES)
+
+
+# Global object
+ANSWER_CACHE = create_answer_cache()
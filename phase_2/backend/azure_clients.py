@@ -0,0 +1,106 @@
+import logging
+import threading
+from typing import TYPE_CHECKING
+
+import httpx
+
+from config import (AZURE_API_VERSION, AZURE_OPENAI_KEY, AZURE_OPENAI_ENDPOINT, OPENAI_ENGINE, EMBEDDING_MODEL,
+                    AZURE_HTTP_MAX_CONNECTIONS, AZURE_HTTP_MAX_KEEPALIVE, AZURE_HTTP_KEEPALIVE_EXPIRY,
+                    AZURE_HTTP_TIMEOUT)
+
+if TYPE_CHECKING:
+    from langchain_openai import AzureChatOpenAI
+    from langchain_openai.embeddings import AzureOpenAIEmbeddings
+
+# Process wide clients, created once in the backend lifespan hook and shared by every request
+HTTP_CLIENT = None
+HTTP_ASYNC_CLIENT = None
+CHAT_LLM = None
+QA_LLM = None
+EMBEDDINGS = None
+_INIT_LOCK = threading.Lock()
+
+
+def _pool_settings() -> dict:
+    return {
+        "limits": httpx.Limits(max_connections=AZURE_HTTP_MAX_CONNECTIONS,
+                               max_keepalive_connections=AZURE_HTTP_MAX_KEEPALIVE,
+                               keepalive_expiry=AZURE_HTTP_KEEPALIVE_EXPIRY),
+        "timeout": httpx.Timeout(AZURE_HTTP_TIMEOUT),
+    }
+
+
+def init_clients():
+    """
+    This function is used to create the pooled keep-alive http transports and the Azure OpenAI clients that use them.
+    It is safe to call more than once and from several threads, existing clients are kept.
+    langchain_openai is imported here and not at module level, importing it is a large part of the startup time.
+    """
+    with _INIT_LOCK:
+        _init_clients()
+
+
+def _init_clients():
+    global HTTP_CLIENT, HTTP_ASYNC_CLIENT, CHAT_LLM, QA_LLM, EMBEDDINGS
+    from langchain_openai import AzureChatOpenAI
+    from langchain_openai.embeddings import AzureOpenAIEmbeddings
+
+    if HTTP_CLIENT is None:
+        HTTP_CLIENT = httpx.Client(**_pool_settings())
+        HTTP_ASYNC_CLIENT = httpx.AsyncClient(**_pool_settings())
+        logging.info("Azure OpenAI http pool created (max %d connections).", AZURE_HTTP_MAX_CONNECTIONS)
+
+    common = {
+        "azure_endpoint": AZURE_OPENAI_ENDPOINT,
+        "api_key": AZURE_OPENAI_KEY,
+        "api_version": AZURE_API_VERSION,
+        "http_client": HTTP_CLIENT,
+        "http_async_client": HTTP_ASYNC_CLIENT,
+    }
+    # The clients do not retry, 429 answers and transient failures are retried by the scheduler that owns the quota
+    if CHAT_LLM is None:
+        CHAT_LLM = AzureChatOpenAI(model=OPENAI_ENGINE, temperature=0, max_retries=0, **common)
+    if QA_LLM is None:
+        # stream_usage adds the token counts to the last chunk of a streamed answer
+        QA_LLM = AzureChatOpenAI(model=OPENAI_ENGINE, temperature=0.3, stream_usage=True, max_retries=0, **common)
+    if EMBEDDINGS is None:
+        EMBEDDINGS = AzureOpenAIEmbeddings(model=EMBEDDING_MODEL, max_retries=0, **common)
+
+
+async def close_clients():
+    """
+    This function is used to close the pooled connections on shutdown.
+    """
+    global HTTP_CLIENT, HTTP_ASYNC_CLIENT, CHAT_LLM, QA_LLM, EMBEDDINGS
+    if HTTP_ASYNC_CLIENT is not None:
+        await HTTP_ASYNC_CLIENT.aclose()
+    if HTTP_CLIENT is not None:
+        HTTP_CLIENT.close()
+    HTTP_CLIENT = HTTP_ASYNC_CLIENT = CHAT_LLM = QA_LLM = EMBEDDINGS = None
+
+
+def get_chat_llm() -> "AzureChatOpenAI":
+    """
+    Returns: the shared deterministic chat model used for the info collection phase
+    """
+    if CHAT_LLM is None:
+        init_clients()
+    return CHAT_LLM
+
+
+def get_qa_llm() -> "AzureChatOpenAI":
+    """
+    Returns: the shared chat model used to answer knowledge base questions
+    """
+    if QA_LLM is None:
+        init_clients()
+    return QA_LLM
+
+
+def get_embeddings() -> "AzureOpenAIEmbeddings":
+    """
+    Returns: the shared embedding model used to build and query the vector store
+    """
+    if EMBEDDINGS is None:
+        init_clients()
+    return EMBEDDINGS
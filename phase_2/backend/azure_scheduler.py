@@ -0,0 +1,291 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Optional
+
+from phase_2.backend.metrics import AZURE_CALLS, STAGE_SECONDS
+from config import (AZURE_CHAT_RPM, AZURE_CHAT_TPM, AZURE_EMBEDDING_RPM, AZURE_EMBEDDING_TPM, AZURE_MAX_QUEUE,
+                    AZURE_MAX_RETRIES, AZURE_RETRY_BASE_SECONDS, AZURE_RETRY_MAX_SECONDS)
+
+# Azure OpenAI enforces its per minute quotas over short windows, a burst may use at most this share of a minute
+BURST_WINDOW_SECONDS = 10
+# Answers of the service that are retried like a 429, without a Retry-After
+TRANSIENT_STATUS_CODES = (408, 409, 500, 502, 503, 504)
+
+
+class SchedulerOverloaded(Exception):
+    """
+    Raised right away when the queue of calls waiting for the Azure quota is full.
+    """
+
+    def __init__(self, deployment: str, retry_after: float):
+        super().__init__(f"Too many requests waiting for the {deployment} deployment, retry in {retry_after:.0f}s")
+        self.deployment = deployment
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at a per minute rate, waiters are served in arrival order.
+    """
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float = BURST_WINDOW_SECONDS):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        # Nothing is refilled while the bucket is paused, see pause
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        paused = max(0.0, self.paused_until - time.monotonic())
+        return paused + max(0.0, (min(amount, self.capacity) - self.tokens) / self.rate)
+
+    async def acquire(self, amount: float):
+        # A single call larger than the burst can never fit, it waits for a full bucket instead
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                paused = self.paused_until - time.monotonic()
+                if paused > 0:
+                    await asyncio.sleep(paused)
+                    continue
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """
+        This function is used to stop every caller for `seconds`, when Azure answered 429 with a Retry-After.
+        Concurrent 429s extend the pause to the latest Retry-After, they do not add up.
+        """
+        self._refill()
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        # The bucket starts empty when the pause ends, the waiting callers do not all go at once
+        self.tokens = min(self.tokens, 0.0)
+        self.updated = max(self.updated, self.paused_until)
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    This function is used to recognize a 429 answer of Azure OpenAI and read how long it asks to wait.
+    Args:
+        error: exception raised by the openai client
+
+    Returns: None when the error is not a rate limit, else the Retry-After in seconds (0 when the header is missing)
+    """
+    response = getattr(error, "response", None)
+    status_code = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status_code != 429:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(retry_after)
+            return max(0.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            # A malformed header falls back to the backoff
+            logging.warning("Cannot read the Retry-After header %r", retry_after)
+    return 0.0
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    This function is used to recognize the failures worth retrying besides 429: timeouts, dropped connections
+    and 5xx answers of the service.
+    """
+    import openai
+
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    status_code = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status_code in TRANSIENT_STATUS_CODES
+
+
+class AzureScheduler:
+    """
+    Client side scheduler of the calls to one Azure OpenAI deployment: requests per minute and tokens per minute
+    token buckets, a bounded queue that rejects extra work right away, retries of 429 answers and transient
+    failures with jittered backoff that honors Retry-After, and coalescing of identical calls that are in flight
+    at the same time.
+    """
+
+    def __init__(self, deployment: str, requests_per_minute: float, tokens_per_minute: float,
+                 max_queue: int = AZURE_MAX_QUEUE, max_retries: int = AZURE_MAX_RETRIES,
+                 retry_base_seconds: float = AZURE_RETRY_BASE_SECONDS,
+                 retry_max_seconds: float = AZURE_RETRY_MAX_SECONDS):
+        self.deployment = deployment
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.waiting = 0
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    async def _admit(self, estimated_tokens: int):
+        """
+        This function is used to wait for the quota of one call, or reject it right away when the queue is full.
+        """
+        if self.waiting >= self.max_queue:
+            AZURE_CALLS.inc(deployment=self.deployment, outcome="rejected")
+            retry_after = max(1.0, self.requests.wait_time(self.waiting + 1))
+            raise SchedulerOverloaded(self.deployment, retry_after)
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            await self.requests.acquire(1)
+            await self.tokens.acquire(estimated_tokens)
+        finally:
+            self.waiting -= 1
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage=f"{self.deployment}_queue_wait")
+
+    async def _backoff(self, error: Exception, attempt: int) -> bool:
+        """
+        This function is used to wait before retrying a rate limited call or a transient failure.
+
+        Returns: False when the error must not be retried
+        """
+        retry_after = get_retry_after(error)
+        if retry_after is None and is_transient(error):
+            retry_after = 0.0
+        if retry_after is None or attempt >= self.max_retries:
+            return False
+        AZURE_CALLS.inc(deployment=self.deployment, outcome="retried")
+        if retry_after:
+            # Every caller waits, not only this one, the deployment is out of quota
+            self.requests.pause(retry_after)
+            delay = retry_after + random.uniform(0, self.retry_base_seconds)
+        else:
+            delay = random.uniform(0, min(self.retry_max_seconds, self.retry_base_seconds * 2 ** attempt))
+        logging.warning("%s deployment call failed (%s), retry %d/%d in %.2fs", self.deployment,
+                        type(error).__name__, attempt + 1, self.max_retries, delay)
+        await asyncio.sleep(delay)
+        return True
+
+    async def _call(self, call: Callable[[], Awaitable[Any]], estimated_tokens: int):
+        attempt = 0
+        while True:
+            await self._admit(estimated_tokens)
+            try:
+                result = await call()
+                AZURE_CALLS.inc(deployment=self.deployment, outcome="ok")
+                return result
+            except Exception as e:
+                if not await self._backoff(e, attempt):
+                    AZURE_CALLS.inc(deployment=self.deployment, outcome="error")
+                    raise
+                attempt += 1
+
+    async def run(self, call: Callable[[], Awaitable[Any]], estimated_tokens: int = 0, key: Hashable = None):
+        """
+        This function is used to run one Azure OpenAI call within the deployment quota.
+        Args:
+            call: function that starts the call, it may be called again to retry
+            estimated_tokens: prompt tokens plus the expected completion tokens
+            key: identity of the call, concurrent calls with the same key share a single request
+
+        Returns: the result of the call
+        """
+        if key is None:
+            return await self._call(call, estimated_tokens)
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            AZURE_CALLS.inc(deployment=self.deployment, outcome="coalesced")
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The caller that ran the shared request went away, run it again
+                return await self.run(call, estimated_tokens, key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await self._call(call, estimated_tokens)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved, there may be no other caller waiting for it
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def stream(self, start_stream: Callable[[], AsyncIterator], estimated_tokens: int = 0) -> AsyncIterator:
+        """
+        This function is used to run a streamed Azure OpenAI call within the deployment quota.
+        Only the start of the stream is retried, chunks already sent to the caller cannot be taken back.
+        Args:
+            start_stream: function that starts the stream, it may be called again to retry
+            estimated_tokens: prompt tokens plus the expected completion tokens
+
+        Returns: async generator of the stream chunks
+        """
+        attempt = 0
+        while True:
+            await self._admit(estimated_tokens)
+            stream = start_stream()
+            try:
+                first_chunk = await stream.__anext__()
+                break
+            except StopAsyncIteration:
+                AZURE_CALLS.inc(deployment=self.deployment, outcome="ok")
+                return
+            except Exception as e:
+                await stream.aclose()
+                if not await self._backoff(e, attempt):
+                    AZURE_CALLS.inc(deployment=self.deployment, outcome="error")
+                    raise
+                attempt += 1
+
+        try:
+            yield first_chunk
+            async for chunk in stream:
+                yield chunk
+            AZURE_CALLS.inc(deployment=self.deployment, outcome="ok")
+        finally:
+            await stream.aclose()
+
+
+def estimate_tokens(*texts: str, completion_tokens: int = 0) -> int:
+    """
+    This function is used to estimate the tokens a call uses from the quota: its prompt and expected completion.
+    """
+    from phase_2.backend.context_packer import count_tokens
+
+    return sum(count_tokens(text or "") for text in texts) + completion_tokens
+
+
+# Global object, one scheduler per Azure OpenAI deployment
+CHAT_SCHEDULER = AzureScheduler("chat", AZURE_CHAT_RPM, AZURE_CHAT_TPM)
+EMBEDDING_SCHEDULER = AzureScheduler("embedding", AZURE_EMBEDDING_RPM, AZURE_EMBEDDING_TPM)
@@ -0,0 +1,30 @@
+import logging
+import os
+import sys
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+from config import EMBEDDING_MODEL, KB_DATA_DIR, OPENAI_ENGINE, TOKENIZER_CACHE_DIR
+from phase_2.backend.context_packer import get_encoding
+from phase_2.backend.vector_store_loader import build_or_update_vector_store, get_artifact_dir, get_index_version
+
+
+def main():
+    """
+    This function is used to build every artifact the backend needs to start with OFFLINE_STARTUP=true:
+    the FAISS index of the knowledge base and the tokenizer data. Run it when building the container image.
+    """
+    logging.basicConfig(level=logging.INFO)
+    # The tokenizers come first, the embeddings client needs its own one to build the index
+    for model in (OPENAI_ENGINE, EMBEDDING_MODEL):
+        if get_encoding(model) is None:
+            sys.exit(f"Cannot download the tokenizer data of {model} into {TOKENIZER_CACHE_DIR}")
+    logging.info("Tokenizer data saved in %s", TOKENIZER_CACHE_DIR)
+
+    _, manifest = build_or_update_vector_store(KB_DATA_DIR)
+    logging.info("Index %s saved in %s", get_index_version(manifest), get_artifact_dir())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+# One row per chunk, the position is the row of its vector in the FAISS index
+SCHEMA = """
+CREATE TABLE chunks (
+    position INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    source_file TEXT NOT NULL,
+    content TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    embedding BLOB NOT NULL
+)
+"""
+
+
+def write_chunk_store(path: Path, chunks: Iterable[Tuple[str, str, Document, np.ndarray]]):
+    """
+    This function is used to write the chunks of the knowledge base into a new SQLite file.
+    The embeddings are kept next to the text so the index can be rebuilt without calling the embedding service.
+    Args:
+        path: path of the new SQLite file
+        chunks: (chunk id, source file name, Document, embedding) tuples, in the order of the FAISS index
+    """
+    connection = sqlite3.connect(str(path))
+    try:
+        connection.execute(SCHEMA)
+        connection.executemany(
+            "INSERT INTO chunks (position, id, source_file, content, metadata, embedding) VALUES (?, ?, ?, ?, ?, ?)",
+            ((position, chunk_id, source_file, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False),
+              np.asarray(embedding, dtype=np.float32).tobytes())
+             for position, (chunk_id, source_file, doc, embedding) in enumerate(chunks)))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+class ChunkStore(Docstore):
+    """
+    Read-only docstore over the SQLite chunk file of the index.
+    Every worker process opens the same file, the chunks live in the shared OS page cache instead of
+    a pickled copy per process.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def ids(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._connection.execute("SELECT id FROM chunks ORDER BY position")]
+
+    def search(self, search: str) -> Union[str, Document]:
+        with self._lock:
+            row = self._connection.execute("SELECT content, metadata FROM chunks WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def iter_contents(self, batch_size: int = 512) -> Iterator[Tuple[int, str]]:
+        """
+        This function is used to read the chunk texts in index order, a batch at a time, without keeping them.
+
+        Returns: iterator of (position, chunk text) tuples
+        """
+        position = -1
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT position, content FROM chunks WHERE position > ? ORDER BY position LIMIT ?",
+                    (position, batch_size)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            position = rows[-1][0]
+
+    def get_by_positions(self, positions: List[int]) -> List[Document]:
+        """
+        This function is used to read the chunks at the given rows of the FAISS index.
+
+        Returns: list of Documents, in the order of `positions`
+        """
+        if not positions:
+            return []
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT position, id, content, metadata FROM chunks WHERE position IN ({','.join('?' * len(positions))})",
+                list(positions)).fetchall()
+        docs = {position: Document(id=chunk_id, page_content=content, metadata=json.loads(metadata))
+                for position, chunk_id, content, metadata in rows}
+        return [docs[position] for position in positions if position in docs]
+
+    def file_chunks(self, source_file: str) -> List[Tuple[str, str, Document, np.ndarray]]:
+        """
+        This function is used to read back the chunks and embeddings of one source file, to reuse them in a rebuild.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, content, metadata, embedding FROM chunks WHERE source_file = ? ORDER BY position",
+                (source_file,)).fetchall()
+        return [(chunk_id, source_file, Document(id=chunk_id, page_content=content, metadata=json.loads(metadata)),
+                 np.frombuffer(embedding, dtype=np.float32))
+                for chunk_id, content, metadata, embedding in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,146 @@
+import logging
+import math
+import os
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from config import OPENAI_ENGINE, TOKENIZER_CACHE_DIR
+
+if TYPE_CHECKING:
+    import tiktoken
+
+# Overlaps shorter than this are treated as a coincidence, not as text repeated by the splitter
+MIN_OVERLAP_CHARS = 20
+BLOCK_SEPARATOR = "\n\n"
+# Used only when the tokenizer data cannot be loaded, a conservative estimate for mixed Hebrew/English text
+APPROX_CHARS_PER_TOKEN = 2.5
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = OPENAI_ENGINE) -> Optional["tiktoken.Encoding"]:
+    """
+    This function is used to load the tokenizer of the chat model once.
+    Its data is read from (and downloaded once into) TOKENIZER_CACHE_DIR, so a container that ships that folder
+    never downloads it.
+
+    Returns: the tiktoken encoding, or None when its data is not available (no network and no local cache)
+    """
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", TOKENIZER_CACHE_DIR)
+    import tiktoken
+
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        logging.warning("Cannot load the tokenizer of %s, token counts are estimated from the text length", model,
+                        exc_info=True)
+        return None
+
+
+def count_tokens(text: str, model: str = OPENAI_ENGINE) -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / APPROX_CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = OPENAI_ENGINE) -> str:
+    """
+    This function is used to cut a text to its first `max_tokens` tokens.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:int(max_tokens * APPROX_CHARS_PER_TOKEN)]
+    tokens = encoding.encode(text)
+    # A cut in the middle of a multi-byte character decodes to a replacement character
+    cut = encoding.decode(tokens[:max_tokens]).rstrip("\ufffd")
+    while cut and count_tokens(cut, model) > max_tokens:
+        cut = cut[:-1]
+    return cut
+
+
+def _overlap_length(previous: str, following: str) -> int:
+    """
+    This function is used to find the longest suffix of `previous` that is repeated as the prefix of `following`.
+    """
+    longest = min(len(previous), len(following))
+    for length in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(following[:length]):
+            return length
+    return 0
+
+
+def merge_adjacent_chunks(docs_and_scores: List[Tuple[Document, float]]) -> List[Tuple[str, float, list]]:
+    """
+    This function is used to merge chunks that were next to each other in the same source file into one block,
+    dropping the text the splitter repeated between them and exact duplicate chunks.
+    Args:
+        docs_and_scores: retrieved Documents and their relevance scores
+
+    Returns: list of (block text, best relevance score of its chunks, [(chunk text, relevance score)]) in source order
+    """
+    seen_contents = set()
+    unique = []
+    for doc, score in docs_and_scores:
+        if doc.page_content in seen_contents:
+            continue
+        seen_contents.add(doc.page_content)
+        unique.append((doc, score))
+
+    def position(item):
+        doc = item[0]
+        return doc.metadata.get("source", ""), doc.metadata.get("chunk_index", -1)
+
+    blocks = []
+    previous_doc = None
+    for doc, score in sorted(unique, key=position):
+        index = doc.metadata.get("chunk_index")
+        is_adjacent = (previous_doc is not None and index is not None
+                       and previous_doc.metadata.get("source") == doc.metadata.get("source")
+                       and previous_doc.metadata.get("chunk_index") == index - 1)
+        if is_adjacent:
+            text, best_score, chunks = blocks[-1]
+            overlap = _overlap_length(text, doc.page_content)
+            blocks[-1] = (text + ("" if overlap else "\n") + doc.page_content[overlap:], max(best_score, score),
+                          chunks + [(doc.page_content, score)])
+        else:
+            blocks.append((doc.page_content, score, [(doc.page_content, score)]))
+        previous_doc = doc
+    return blocks
+
+
+def pack_context(docs_and_scores: List[Tuple[Document, float]], token_budget: int) -> str:
+    """
+    This function is used to assemble the knowledge block of the QA prompt.
+    Adjacent chunks are merged, and the merged blocks are added from the most to the least relevant as long as they fit
+    in the token budget. A block that does not fit is split back into its chunks, and when even the most relevant
+    chunk is over the budget it is cut to the budget, so the context is never left empty.
+    Args:
+        docs_and_scores: retrieved Documents and their relevance scores
+        token_budget: maximum number of tokens of the knowledge block
+
+    Returns: the knowledge block text
+    """
+    separator_tokens = count_tokens(BLOCK_SEPARATOR)
+    packed, used_tokens = [], 0
+
+    def add(text: str) -> bool:
+        nonlocal used_tokens
+        tokens = count_tokens(text) + (separator_tokens if packed else 0)
+        if not text or used_tokens + tokens > token_budget:
+            return False
+        packed.append(text)
+        used_tokens += tokens
+        return True
+
+    for text, _, chunks in sorted(merge_adjacent_chunks(docs_and_scores), key=lambda block: block[1], reverse=True):
+        if add(text) or (len(chunks) == 1 and packed):
+            continue
+        for chunk_text, _ in sorted(chunks, key=lambda chunk: chunk[1], reverse=True):
+            if not add(chunk_text) and not packed:
+                add(truncate_to_tokens(chunk_text, token_budget))
+    return BLOCK_SEPARATOR.join(packed)
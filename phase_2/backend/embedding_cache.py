@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict
+from typing import List
+
+from phase_2.backend.answer_cache import normalize_question
+from phase_2.backend.azure_scheduler import EMBEDDING_SCHEDULER, estimate_tokens
+from phase_2.backend.metrics import CACHE_LOOKUPS
+from config import EMBEDDING_MODEL, QUERY_EMBEDDING_CACHE_SIZE
+
+
+class QueryEmbeddingCache:
+    """
+    In-process LRU cache of question embeddings keyed by the embedding model and the normalized question,
+    so a repeated question does not pay for the embedding round trip.
+    """
+
+    def __init__(self, max_entries: int, model: str = EMBEDDING_MODEL):
+        self.max_entries = max_entries
+        self.model = model
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def embed_query(self, embeddings, question: str) -> List[float]:
+        """
+        This function is used to embed a question, or return the embedding of the same question computed before.
+        Args:
+            embeddings: the embeddings client of the vector store
+            question: the user question
+
+        Returns: the question embedding
+        """
+        key = (self.model, normalize_question(question))
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.inc(cache="query_embedding", result="hit")
+                return vector
+
+        self.misses += 1
+        CACHE_LOOKUPS.inc(cache="query_embedding", result="miss")
+        # Concurrent misses of the same question share one embedding request
+        vector = await EMBEDDING_SCHEDULER.run(lambda: embeddings.aembed_query(question), estimate_tokens(question),
+                                               key=key)
+        with self._lock:
+            self._entries[key] = vector
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return vector
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Global object
+QUERY_EMBEDDING_CACHE = QueryEmbeddingCache(QUERY_EMBEDDING_CACHE_SIZE)
@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from phase_2.backend.azure_scheduler import AzureScheduler, estimate_tokens
+from phase_2.backend.metrics import EMBEDDED_CHUNKS
+from config import AZURE_EMBEDDING_RPM, AZURE_EMBEDDING_TPM, EMBEDDING_BATCH_SIZE, EMBEDDING_CONCURRENCY
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def embed_texts(embeddings, texts: List[str], known: Optional[Dict[str, np.ndarray]] = None,
+                batch_size: int = EMBEDDING_BATCH_SIZE, concurrency: int = EMBEDDING_CONCURRENCY,
+                progress: Optional[Callable[[int, int], None]] = None) -> List[np.ndarray]:
+    """
+    This function is used to embed the chunks of an index build. Every distinct text is embedded once, texts
+    already embedded before (`known`) are not sent again, and the rest is sent in batches of `batch_size`
+    with up to `concurrency` batches in flight within the embedding deployment quota.
+    Failed batches are retried like every Azure OpenAI call, see AzureScheduler.
+    Args:
+        embeddings: the embeddings client
+        texts: the chunk texts, duplicates allowed
+        known: embeddings of texts already indexed, keyed by text_key
+        batch_size: texts per embedding request
+        concurrency: embedding requests in flight at the same time
+        progress: called with (embedded texts, texts to embed) after every batch
+
+    Returns: the embedding of every text, in the order of `texts`
+    """
+    vectors = dict(known or {})
+    keys = [text_key(text) for text in texts]
+    pending = {}
+    for key, text in zip(keys, texts):
+        if key not in vectors:
+            pending.setdefault(key, text)
+    logging.info("Embedding %d distinct chunks out of %d (%d duplicates or already embedded)",
+                 len(pending), len(texts), len(texts) - len(pending))
+
+    if pending:
+        pending_keys = list(pending)
+        batches = [pending_keys[i:i + batch_size] for i in range(0, len(pending_keys), batch_size)]
+        # The build runs in its own event loop, it gets its own scheduler instead of the shared one
+        build = _embed_batches(embeddings, pending, batches, vectors, concurrency, progress)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(build)
+        else:
+            # Called from a coroutine, the loop of this thread is already running
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(asyncio.run, build).result()
+
+    return [vectors[key] for key in keys]
+
+
+async def _embed_batches(embeddings, pending: Dict[str, str], batches: List[List[str]], vectors: dict,
+                         concurrency: int, progress: Optional[Callable[[int, int], None]]):
+    scheduler = AzureScheduler("embedding_build", AZURE_EMBEDDING_RPM, AZURE_EMBEDDING_TPM, max_queue=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+    done = 0
+
+    async def embed_batch(batch_keys: List[str]):
+        nonlocal done
+        batch = [pending[key] for key in batch_keys]
+        async with semaphore:
+            # The synchronous client is thread safe, its calls run in the default thread pool
+            batch_vectors = await scheduler.run(lambda: asyncio.to_thread(embeddings.embed_documents, batch),
+                                                estimate_tokens(*batch))
+        for key, vector in zip(batch_keys, batch_vectors):
+            vectors[key] = np.asarray(vector, dtype=np.float32)
+        EMBEDDED_CHUNKS.inc(len(batch))
+        done += len(batch)
+        elapsed = time.perf_counter() - started
+        logging.info("Embedded %d/%d chunks (%.1f chunks/s)", done, len(pending), done / elapsed if elapsed else 0.0)
+        if progress is not None:
+            progress(done, len(pending))
+
+    await asyncio.gather(*(embed_batch(batch_keys) for batch_keys in batches))
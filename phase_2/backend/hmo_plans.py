@@ -0,0 +1,68 @@
+from typing import Optional
+
+# Canonical (Hebrew, as written in the knowledge base) HMO and membership tier names and their accepted spellings
+HMO_ALIASES = {
+    "מכבי": ["מכבי", "maccabi", "makabi", "macabi"],
+    "מאוחדת": ["מאוחדת", "meuhedet", "meuchedet", "meuhedeth"],
+    "כללית": ["כללית", "clalit", "klalit"],
+}
+TIER_ALIASES = {
+    "זהב": ["זהב", "gold"],
+    "כסף": ["כסף", "silver"],
+    "ארד": ["ארד", "bronze"],
+}
+
+# Metadata value of chunks that are relevant for every HMO or every tier
+ALL_PLANS = "all"
+
+
+def _normalize(value: Optional[str], aliases: dict) -> Optional[str]:
+    value = (value or "").strip().strip('"\'').casefold()
+    for canonical, spellings in aliases.items():
+        if value in spellings:
+            return canonical
+    return None
+
+
+def normalize_hmo(hmo_name: Optional[str]) -> Optional[str]:
+    """
+    This function is used to map an HMO name in Hebrew or English to its knowledge base name.
+    Args:
+        hmo_name: HMO name as the user wrote it
+
+    Returns: canonical HMO name or None when it is not recognized
+    """
+    return _normalize(hmo_name, HMO_ALIASES)
+
+
+def normalize_tier(membership_tier: Optional[str]) -> Optional[str]:
+    """
+    This function is used to map a membership tier in Hebrew or English to its knowledge base name.
+    Args:
+        membership_tier: membership tier as the user wrote it
+
+    Returns: canonical tier name or None when it is not recognized
+    """
+    return _normalize(membership_tier, TIER_ALIASES)
+
+
+def plan_filter(hmo_name: Optional[str], membership_tier: Optional[str]):
+    """
+    This function is used to build the metadata filter that keeps only the chunks of the user's plan
+    and the chunks that apply to every plan.
+    Args:
+        hmo_name: user HMO
+        membership_tier: user membership tier
+
+    Returns: filter function over the chunk metadata, or None when the plan is not recognized
+    """
+    hmo = normalize_hmo(hmo_name)
+    tier = normalize_tier(membership_tier)
+    if hmo is None and tier is None:
+        return None
+
+    def _filter(metadata: dict) -> bool:
+        return ((hmo is None or metadata.get("hmo", ALL_PLANS) in (ALL_PLANS, hmo)) and
+                (tier is None or metadata.get("tier", ALL_PLANS) in (ALL_PLANS, tier)))
+
+    return _filter
@@ -1,9 +1,203 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
 from pathlib import Path
-from typing import List
+from typing import Dict, List
 
-from langchain_community.document_loaders import UnstructuredHTMLLoader
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from phase_2.backend.hmo_plans import ALL_PLANS, normalize_hmo, normalize_tier
+
+# Chunking settings, they are part of the persisted index key so changing them triggers a rebuild
+MAX_SECTION_CHARS = 1000
+PARSER_VERSION = "service-sections-2"
+# Below this number of files forking worker processes costs more than parsing in the current process
+PARALLEL_MIN_FILES = 8
+
+# Service category of every knowledge base file, files that are not listed use their own name
+CATEGORY_BY_FILE = {
+    "alternative_services": "alternative_medicine",
+    "communication_clinic_services": "communication_clinic",
+    "dentel_services": "dental",
+    "optometry_services": "optometry",
+    "pragrency_services": "pregnancy",
+    "workshops_services": "workshops",
+}
+
+_BLOCK_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6", "p", "li"}
+
+
+class ServicePageParser(HTMLParser):
+    """
+    Parses a service page into its blocks, keeping the structure of the tables:
+    ("heading", text), ("paragraph", text), ("list_item", text) and ("table", rows of cell texts).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.blocks = []
+        self._text = []
+        self._rows = None
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            self._rows = []
+        elif tag == "tr" and self._rows is not None:
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = []
+        elif tag == "br":
+            (self._cell if self._cell is not None else self._text).append("\n")
+        elif tag in _BLOCK_TAGS and self._rows is None:
+            self._text = []
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self._cell is not None:
+            self._row.append(_clean_text("".join(self._cell)))
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            self._rows.append(self._row)
+            self._row = None
+        elif tag == "table" and self._rows is not None:
+            self.blocks.append(("table", self._rows))
+            self._rows = None
+        elif tag in _BLOCK_TAGS and self._rows is None:
+            text = _clean_text("".join(self._text))
+            if text:
+                kind = "heading" if tag.startswith("h") else "list_item" if tag == "li" else "paragraph"
+                self.blocks.append((kind, text))
+            self._text = []
+
+    def handle_data(self, data):
+        (self._cell if self._cell is not None else self._text).append(data)
+
+
+def _clean_text(text: str) -> str:
+    lines = (" ".join(line.split()) for line in text.split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+def get_category(html_file: Path) -> str:
+    return CATEGORY_BY_FILE.get(html_file.stem, html_file.stem)
+
+
+def get_splitter_settings() -> dict:
+    """
+    This function is used to describe the chunking settings used by load_knowledgebase.
+
+    Returns: dict of the splitter settings
+    """
+    return {"parser": PARSER_VERSION, "max_section_chars": MAX_SECTION_CHARS}
+
+
+def _table_documents(rows: list, title: str, metadata: dict) -> List[Document]:
+    """
+    This function is used to turn a service table into one Document per service, HMO and tier.
+    The header row holds the HMO names and every cell holds one "tier: benefit" line per tier.
+    """
+    if len(rows) < 2:
+        return []
+    header = rows[0]
+    docs = []
+    for row in rows[1:]:
+        service = row[0] if row else ""
+        for hmo_header, cell in zip(header[1:], row[1:]):
+            hmo = normalize_hmo(hmo_header) or ALL_PLANS
+            for line in cell.split("\n"):
+                tier_name, _, benefit = line.partition(":")
+                tier = normalize_tier(tier_name)
+                if tier is None:
+                    tier = ALL_PLANS
+                    content = f"{title} - {service} - {hmo_header}: {line}"
+                else:
+                    content = f"{title} - {service} - {hmo_header} - {tier_name.strip()}: {benefit.strip()}"
+                docs.append(Document(page_content=content,
+                                     metadata={**metadata, "service": service, "hmo": hmo, "tier": tier}))
+    return docs
+
+
+def _section_documents(heading: str, title: str, blocks: list, metadata: dict) -> List[Document]:
+    """
+    This function is used to turn the text of one section into chunks that always start with the section heading.
+    Blocks are never cut, a section longer than MAX_SECTION_CHARS is split between blocks.
+    """
+    prefix = heading if heading == title else f"{title} - {heading}"
+    docs, current = [], []
+    for block in blocks:
+        if current and len(prefix) + sum(len(text) + 1 for text in current) + len(block) > MAX_SECTION_CHARS:
+            docs.append("\n".join([prefix, *current]))
+            current = []
+        current.append(block)
+    if current:
+        docs.append("\n".join([prefix, *current]))
+    return [Document(page_content=content, metadata={**metadata, "section": heading, "hmo": ALL_PLANS, "tier": ALL_PLANS})
+            for content in docs]
+
+
+def load_html_file(html_file: Path) -> List[Document]:
+    """
+    This function is used to load a single html file and split it into chunks.
+    Every table row is expanded into one chunk per HMO and tier, list items that start with an HMO name
+    (phone numbers, links) are tagged with that HMO, and the rest of the text is chunked by section.
+    Args:
+        html_file: path of the html file
+
+    Returns: list of Documents tagged with category, hmo, tier and chunk_index metadata
+    """
+    html_file = Path(html_file)
+    parser = ServicePageParser()
+    parser.feed(html_file.read_text(encoding="utf-8"))
+    parser.close()
+
+    metadata = {"source": str(html_file), "category": get_category(html_file)}
+    title = next((text for kind, text in parser.blocks if kind == "heading"), html_file.stem)
+    docs, section_blocks = [], []
+    heading = title
+    for kind, value in parser.blocks:
+        if kind == "table":
+            docs.extend(_section_documents(heading, title, section_blocks, metadata))
+            docs.extend(_table_documents(value, title, metadata))
+            section_blocks = []
+            continue
+        if kind == "heading":
+            docs.extend(_section_documents(heading, title, section_blocks, metadata))
+            heading, section_blocks = value, []
+            continue
+        hmo = normalize_hmo(value.split(":", 1)[0]) if kind == "list_item" else None
+        if hmo is not None:
+            docs.append(Document(page_content=f"{title} - {heading}\n{value}",
+                                 metadata={**metadata, "section": heading, "hmo": hmo, "tier": ALL_PLANS}))
+        else:
+            section_blocks.append(value)
+    docs.extend(_section_documents(heading, title, section_blocks, metadata))
+
+    for chunk_index, doc in enumerate(docs):
+        doc.metadata["chunk_index"] = chunk_index
+    return docs
+
+
+def load_html_files(html_files: List[Path], max_workers: int = None) -> Dict[str, List[Document]]:
+    """
+    This function is used to parse several html files in parallel, one process per core.
+    Small batches (an incremental index update, the sample knowledge base) are parsed in the current process.
+    Args:
+        html_files: paths of the html files
+        max_workers: number of processes, defaults to the number of cores
+
+    Returns: Dict[file name, list of Documents]
+    """
+    html_files = [Path(html_file) for html_file in html_files]
+    max_workers = min(max_workers or os.cpu_count() or 1, len(html_files))
+    if max_workers <= 1 or len(html_files) < PARALLEL_MIN_FILES:
+        return {html_file.name: load_html_file(html_file) for html_file in html_files}
+
+    # Spawned, not forked: the caller runs next to the event loop, the http pools and the watcher thread, and a fork
+    # of a threaded process can copy a lock another thread holds and deadlock
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return {html_file.name: docs for html_file, docs in zip(html_files, executor.map(load_html_file, html_files))}
 
 
 def load_knowledgebase(folder_path="../data") -> List[Document]:
@@ -15,13 +209,5 @@ def load_knowledgebase(folder_path="../data") -> List[Document]:
     Returns:
 
     """
-
-    knowledge_base_docs = []
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    for html_file in Path(folder_path).glob("*.html"):
-        loader = UnstructuredHTMLLoader(html_file)
-        doc = loader.load()
-        split_docs = text_splitter.split_documents(doc)
-        knowledge_base_docs.extend(split_docs)
-
-    return knowledge_base_docs
+    docs_by_file = load_html_files(sorted(Path(folder_path).glob("*.html")))
+    return [doc for docs in docs_by_file.values() for doc in docs]
@@ -0,0 +1,76 @@
+import logging
+import threading
+from pathlib import Path
+
+from config import KB_DATA_DIR, KB_RELOAD_INTERVAL_SECONDS, OFFLINE_STARTUP
+
+
+def get_fingerprint(data_dir=KB_DATA_DIR, artifact_dir=None) -> tuple:
+    """
+    This function is used to detect changes cheaply: the name, size and modification time of every knowledge base
+    file and of the index manifest. A worker that did not build the new index notices it through the manifest.
+    """
+    # Imported on use, the loader and its dependencies are imported by the startup thread, not by the server
+    from phase_2.backend import vector_store_loader
+
+    artifact_dir = Path(artifact_dir) if artifact_dir else vector_store_loader.get_artifact_dir()
+    paths = [*sorted(Path(data_dir).glob("*.html")), artifact_dir / vector_store_loader.MANIFEST_FILE]
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        fingerprint.append((str(path), stat.st_size, stat.st_mtime_ns))
+    return tuple(fingerprint)
+
+
+class KnowledgeBaseWatcher:
+    """
+    Background thread that polls the knowledge base folder and reloads the index when a file is added, changed
+    or removed, or when another worker saved a new index.
+    """
+
+    def __init__(self, interval_seconds: float = KB_RELOAD_INTERVAL_SECONDS, offline: bool = OFFLINE_STARTUP):
+        self.interval_seconds = interval_seconds
+        self.offline = offline
+        self._stop = threading.Event()
+        self._thread = None
+        self._fingerprint = None
+
+    def start(self):
+        if self.interval_seconds <= 0:
+            logging.info("Knowledge base watcher disabled, use POST /admin/reload to reload the index.")
+            return
+        # Taken before the startup load reads the files, a change made during the load is reloaded afterwards
+        self._fingerprint = get_fingerprint()
+        self._thread = threading.Thread(target=self._run, name="kb-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        from phase_2.backend import vector_store_loader
+
+        while not self._stop.wait(self.interval_seconds):
+            # The startup load runs on its own, the watcher only follows the changes after it
+            if vector_store_loader.SNAPSHOT is None:
+                continue
+            fingerprint = get_fingerprint()
+            if fingerprint == self._fingerprint:
+                continue
+            logging.info("Knowledge base files changed, reloading the index.")
+            try:
+                vector_store_loader.reload_vector_store(offline=self.offline)
+            except Exception:
+                # The fingerprint is kept, the next poll tries again
+                logging.exception("Knowledge base reload failed, still serving index version %s",
+                                  vector_store_loader.SNAPSHOT.version)
+                continue
+            # Files changed during the reload (and the manifest it saved) trigger one more reload, a no-op when
+            # nothing else changed
+            self._fingerprint = fingerprint
@@ -0,0 +1,149 @@
+import math
+import re
+import unicodedata
+from array import array
+from collections import Counter, defaultdict
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+if TYPE_CHECKING:
+    from phase_2.backend.chunk_store import ChunkStore
+
+# BM25 parameters, the usual defaults
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Rank constant of the reciprocal rank fusion, larger values flatten the weight of the top ranks
+RRF_K = 60
+# Best scoring chunks read from the chunk store at a time while looking for the ones that pass the filter
+FETCH_BATCH_SIZE = 32
+# One letter Hebrew prefixes (and, the, in, to, from, that, as) that are glued to the word they precede
+HEBREW_PREFIXES = "והבלמשכ"
+# Plural and construct suffixes, "טיפולי" and "טיפולים" match "טיפול"
+HEBREW_SUFFIXES = ("ים", "ות", "י")
+
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+_HEBREW_RE = re.compile(r"[֐-׿]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    This function is used to split a text into index terms.
+    Hebrew words are indexed both as written and without a one letter prefix and a plural suffix.
+    Args:
+        text: chunk or question text
+
+    Returns: list of terms
+    """
+    terms = []
+    for word in _WORD_RE.findall(unicodedata.normalize("NFKC", text or "").casefold()):
+        terms.append(word)
+        if not _HEBREW_RE.match(word):
+            continue
+        stems = [word[1:]] if len(word) > 3 and word[0] in HEBREW_PREFIXES else []
+        for stem in [word, *stems]:
+            suffix = next((suffix for suffix in HEBREW_SUFFIXES if stem.endswith(suffix)), None)
+            if suffix and len(stem) - len(suffix) >= 3:
+                stems.append(stem[:-len(suffix)])
+        terms.extend(stems)
+    return terms
+
+
+def document_key(doc: Document) -> tuple:
+    return doc.metadata.get("source", ""), doc.metadata.get("chunk_index", -1), doc.page_content
+
+
+class BM25Index:
+    """
+    In-memory inverted index with BM25 scoring over the knowledge base chunks.
+    Only the term statistics are kept in memory, chunks are referred to by their row in the FAISS index and the
+    best matches are read from the shared chunk store.
+    """
+
+    def __init__(self, chunk_store: "ChunkStore", contents: Optional[Iterable[Tuple[int, str]]] = None):
+        """
+        Args:
+            chunk_store: chunk store of the index, the texts and metadata of the results are read from it
+            contents: (position, chunk text) tuples to index, all the chunks of the store by default
+        """
+        self.chunk_store = chunk_store
+        # Compact arrays of positions and term frequencies per term
+        self._postings: Dict[str, Tuple[array, array]] = defaultdict(lambda: (array("I"), array("I")))
+        self._lengths: Dict[int, int] = {}
+        for position, content in (contents if contents is not None else chunk_store.iter_contents()):
+            counts = Counter(tokenize(content))
+            self._lengths[position] = sum(counts.values())
+            for term, frequency in counts.items():
+                positions, frequencies = self._postings[term]
+                positions.append(position)
+                frequencies.append(frequency)
+        self._postings = dict(self._postings)
+        self._average_length = (sum(self._lengths.values()) / len(self._lengths)) if self._lengths else 0.0
+        self._idf = {term: math.log(1 + (len(self._lengths) - len(postings[0]) + 0.5) / (len(postings[0]) + 0.5))
+                     for term, postings in self._postings.items()}
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def search(self, query: str, k: int, metadata_filter: Optional[Callable[[dict], bool]] = None) -> List[Tuple[Document, float]]:
+        """
+        This function is used to find the chunks that best match the terms of the question.
+        Args:
+            query: the user question
+            k: maximum number of chunks
+            metadata_filter: optional filter over the chunk metadata, like the one of the vector store
+
+        Returns: list of (Document, BM25 score) tuples, best first, only chunks that share a term with the question
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for position, frequency in zip(*self._postings[term]):
+                length_norm = 1 - BM25_B + BM25_B * self._lengths[position] / self._average_length
+                scores[position] += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        # Chunks are read in small batches, the filter usually keeps k of them in the first one
+        for start in range(0, len(ranked), FETCH_BATCH_SIZE):
+            batch = ranked[start:start + FETCH_BATCH_SIZE]
+            docs = self.chunk_store.get_by_positions([position for position, _ in batch])
+            for doc, (_, score) in zip(docs, batch):
+                if metadata_filter is not None and not metadata_filter(doc.metadata):
+                    continue
+                results.append((doc, score))
+                if len(results) >= k:
+                    return results
+        return results
+
+    def covers_query(self, query: str, results: List[Tuple[Document, float]]) -> bool:
+        """
+        This function is used to decide if a keyword query is fully answered by the lexical results,
+        which is the case when the best chunk contains every word of the question.
+        """
+        words = _WORD_RE.findall(unicodedata.normalize("NFKC", query or "").casefold())
+        if not words or not results:
+            return False
+        best_terms = set(tokenize(results[0][0].page_content))
+        return all(set(tokenize(word)) & best_terms for word in words)
+
+
+def reciprocal_rank_fusion(*rankings: List[Tuple[Document, float]], k: int = RRF_K) -> List[Tuple[Document, float]]:
+    """
+    This function is used to merge ranked result lists whose scores are not comparable (similarity and BM25).
+    Every chunk gets the sum of 1 / (k + rank) over the lists it appears in.
+    Args:
+        rankings: result lists of (Document, score) tuples, best first
+        k: rank constant
+
+    Returns: list of (Document, fused score) tuples, best first
+    """
+    fused, docs = defaultdict(float), {}
+    for ranking in rankings:
+        for rank, (doc, _) in enumerate(ranking, start=1):
+            key = document_key(doc)
+            docs.setdefault(key, doc)
+            fused[key] += 1 / (k + rank)
+    return [(docs[key], score) for key, score in sorted(fused.items(), key=lambda item: item[1], reverse=True)]
@@ -1,43 +1,173 @@
+import asyncio
+import json
+import logging
+import math
 import os
+import secrets
 import sys
-import nltk
-import ssl
+import time
 
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 sys.path.append(project_root)
 
-from fastapi import FastAPI, Request
-from contextlib import asynccontextmanager
-from vector_store_loader import load_vector_store_once
-from phase_2.llm_client import extract_user_info_with_gpt, get_qa_chain_response
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from contextlib import aclosing, asynccontextmanager, nullcontext
+from pydantic import ValidationError
+from config import ADMIN_TOKEN, CHAT_HISTORY_WINDOW
+from phase_2.backend import startup
+from phase_2.backend.azure_clients import close_clients
+from phase_2.backend.azure_scheduler import SchedulerOverloaded
+from phase_2.backend.kb_watcher import KnowledgeBaseWatcher
+from phase_2.backend.metrics import CHAT_TURNS, ERRORS, REGISTRY, REQUEST_SECONDS, TRACER
+from phase_2.backend.models import ChatSession
+from phase_2.backend.session_store import SESSION_STORE
+from phase_2.backend.slot_parser import answer_locally
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
-    This function is used to runs only once, it downloads nltk package and load the knownladge base into FAISS database.
+    This function is used to runs only once, it starts creating the shared Azure OpenAI clients
+    and loading the knownladge base into FAISS database in a worker thread.
+    The server answers /healthz right away and /ready once the startup work is done.
     Args:
         app:
 
     Returns:
 
     """
-    # Disable SSL certificate verification (only if certifi fails)
-    ssl._create_default_https_context = ssl._create_unverified_context
-    nltk.download('punkt')
-    load_vector_store_once()
+    watcher = KnowledgeBaseWatcher()
+
+    def start_up():
+        # The watcher is started from the worker thread too, it imports the index loader
+        watcher.start()
+        startup.run_startup()
+
+    startup_task = asyncio.create_task(asyncio.to_thread(start_up))
     yield
+    await startup_task
+    await asyncio.to_thread(watcher.stop)
+    await close_clients()
 
 app = FastAPI(lifespan=lifespan)
 
 
+@app.exception_handler(SchedulerOverloaded)
+async def scheduler_overloaded(request: Request, exc: SchedulerOverloaded):
+    """
+    This function is used to answer 503 right away when too many calls already wait for the Azure OpenAI quota,
+    instead of letting the request queue until the client times out.
+    """
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": str(math.ceil(exc.retry_after))})
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    This function is used to time every request and, when tracing is enabled, open the request span
+    that the pipeline stage spans are nested in.
+    """
+    started = time.perf_counter()
+    status = 500
+    # The span is renamed once the route is known, see below
+    span_context = TRACER.start_as_current_span(request.method) if TRACER is not None else nullcontext()
+    with span_context as span:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        except Exception:
+            ERRORS.inc(stage="http")
+            raise
+        finally:
+            # The route template, not the raw path, keeps one time series per endpoint whatever URLs are requested
+            route = request.scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            if span is not None:
+                span.update_name(f"{request.method} {path}")
+            REQUEST_SECONDS.observe(time.perf_counter() - started, path=path, status=status)
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    This function is used to expose the latency, token, cache and error metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/healthz")
+async def healthz():
+    """
+    This function is used as the liveness probe, the process is up and serving http.
+    """
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """
+    This function is used as the readiness probe, it answers 200 only once the clients and the index are loaded.
+    """
+    body = {"ready": startup.READY.is_set(), "startup_seconds": startup.STARTUP_TIMINGS, "index_version": None}
+    if body["ready"]:
+        # Imported by the startup thread, see run_startup
+        from phase_2.backend import vector_store_loader
+        body["index_version"] = vector_store_loader.SNAPSHOT.version
+    if startup.STARTUP_ERROR:
+        body["error"] = startup.STARTUP_ERROR
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+
+@app.post("/admin/reload", status_code=202)
+async def reload_knowledge_base(request: Request):
+    """
+    This function is used to reload the knowledge base after its files changed, without waiting for the watcher.
+    Only the changed files are embedded again, in the background, and the new index replaces the old one at once.
+    """
+    # Disabled unless a token is configured, the watcher still picks up the changes
+    if not ADMIN_TOKEN or not secrets.compare_digest(request.headers.get("X-Admin-Token", "").encode(),
+                                                     ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    if not startup.READY.is_set():
+        raise HTTPException(status_code=503, detail="The knowledge base is still loading")
+    from phase_2.backend import vector_store_loader
+
+    async def reload():
+        try:
+            await asyncio.to_thread(vector_store_loader.reload_vector_store)
+        except Exception:
+            ERRORS.inc(stage="index_reload")
+            logging.exception("Knowledge base reload failed")
+
+    # Keep a reference, the event loop only holds a weak one to running tasks
+    app.state.reload_task = asyncio.create_task(reload())
+    return {"status": "reloading", "index_version": vector_store_loader.SNAPSHOT.version}
+
+
 @app.post("/chat")
 async def collect_data(request: Request):
+    """
+    This function is used to continue the info collection conversation, the client sends only the new message
+    and the session id it got in the previous answer. A missing or expired session id starts a new conversation.
+    Simple form filling turns are answered locally, only free form or ambiguous turns go to the LLM.
+    """
     data = await request.json()
-    user_prompt = data.get("user_prompt", {})
-    messages = data.get("messages", [])
-    res = extract_user_info_with_gpt(user_prompt, messages)
-    return res
+    user_prompt = data.get("user_prompt", "")
+    session_id = data.get("session_id")
+    session = await SESSION_STORE.get(session_id) if session_id else None
+    if session is None:
+        session = ChatSession()
+    res = answer_locally(user_prompt, session)
+    CHAT_TURNS.inc(path="local" if res is not None else "llm")
+    if res is None:
+        from phase_2.llm_client import extract_user_info_with_gpt
+        res = await extract_user_info_with_gpt(user_prompt, session)
+    # The structured user info carries the older turns, only the recent window is kept
+    session.messages = session.messages[-CHAT_HISTORY_WINDOW:]
+    await SESSION_STORE.save(session)
+    return {**res, "session_id": session.session_id}
 
 
 @app.post("/qa")
@@ -45,5 +175,53 @@ async def qa_phase(request: Request):
     data = await request.json()
     user_info = data.get("user_info", {})
     user_prompt = data.get("user_prompt", {})
-    content = get_qa_chain_response(user_prompt, user_info)
+    from phase_2.llm_client import get_qa_chain_response
+    content = await get_qa_chain_response(user_prompt, user_info)
     return {"content": content}
+
+
+@app.post("/qa/warmup")
+async def qa_warmup(request: Request):
+    """
+    This function is used by the frontend once the user info is confirmed, the QA phase is ready before the
+    first question arrives.
+    """
+    from phase_2.llm_client import warm_up_qa
+    data = await request.json()
+    try:
+        return await warm_up_qa(data.get("user_info", {}))
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+
+
+@app.post("/qa/stream")
+async def qa_phase_stream(request: Request):
+    """
+    This function is used to stream the QA answer as NDJSON lines:
+    {"type": "token", "content": "..."} for every chunk and a final {"type": "done"} (or {"type": "error"}).
+    The generator stops, and the Azure stream is closed, as soon as the client disconnects.
+    """
+    data = await request.json()
+    user_info = data.get("user_info", {})
+    user_prompt = data.get("user_prompt", {})
+
+    from phase_2.llm_client import stream_qa_chain_response
+
+    async def ndjson_stream():
+        try:
+            async with aclosing(stream_qa_chain_response(user_prompt, user_info)) as tokens:
+                async for token in tokens:
+                    if await request.is_disconnected():
+                        logging.info("Client disconnected, stopping the QA stream.")
+                        return
+                    yield json.dumps({"type": "token", "content": token}, ensure_ascii=False) + "\n"
+            yield json.dumps({"type": "done"}) + "\n"
+        except SchedulerOverloaded as e:
+            logging.warning("QA stream rejected: %s", e)
+            yield json.dumps({"type": "error", "content": str(e), "retry_after": math.ceil(e.retry_after)}) + "\n"
+        except Exception:
+            ERRORS.inc(stage="qa_stream")
+            logging.exception("QA stream failed")
+            yield json.dumps({"type": "error", "content": "Failed to generate an answer"}) + "\n"
+
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
@@ -0,0 +1,197 @@
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, Tuple
+
+from config import TRACING_ENABLED
+
+# Latency buckets in seconds, from a cache hit to a long completion
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """
+    Monotonic counter with labels, rendered in the Prometheus text format.
+    """
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name if name.endswith("_total") else name + "_total"
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, zip(self.label_names, key), value
+
+
+class Histogram:
+    """
+    Histogram with cumulative buckets and labels, rendered in the Prometheus text format.
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [bucket counts, sum, count]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {key: ([*counts], total, count) for key, (counts, total, count) in self._values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            labels = list(zip(self.label_names, key))
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield self.name + "_bucket", [*labels, ("le", _format_value(bound))], bucket_count
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, count
+
+
+class MetricsRegistry:
+    """
+    Process wide set of metrics exposed on the /metrics endpoint.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                  buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        This function is used to render every metric in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Global object
+REGISTRY = MetricsRegistry()
+
+REQUEST_SECONDS = REGISTRY.histogram("http_request_duration_seconds", "Duration of the HTTP requests.",
+                                     ("path", "status"))
+STAGE_SECONDS = REGISTRY.histogram("stage_duration_seconds", "Duration of every stage of the chat and QA pipelines.",
+                                   ("stage",))
+LLM_TOKENS = REGISTRY.counter("llm_tokens", "Tokens sent to and generated by Azure OpenAI.", ("use", "kind"))
+CACHE_LOOKUPS = REGISTRY.counter("cache_lookups", "Cache lookups by cache and result (hit or miss).", ("cache", "result"))
+RETRIEVED_CHUNKS = REGISTRY.histogram("retrieved_chunks", "Number of knowledge base chunks retrieved per question.",
+                                      ("source",), buckets=COUNT_BUCKETS)
+CHAT_TURNS = REGISTRY.counter("chat_turns", "Info collection turns by the path that answered them.", ("path",))
+EMBEDDED_CHUNKS = REGISTRY.counter("embedded_chunks", "Knowledge base chunks sent to the embedding service.")
+ERRORS = REGISTRY.counter("errors", "Errors by stage.", ("stage",))
+AZURE_CALLS = REGISTRY.counter("azure_calls", "Azure OpenAI calls by deployment and outcome "
+                               "(ok, error, retried, rejected, coalesced).", ("deployment", "outcome"))
+
+
+def _get_tracer():
+    if not TRACING_ENABLED:
+        return None
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        logging.warning("TRACING_ENABLED is set but opentelemetry is not installed, spans are not recorded")
+        return None
+    return trace.get_tracer("phase_2.backend")
+
+
+TRACER = _get_tracer()
+
+
+@contextmanager
+def track_stage(stage: str, **attributes):
+    """
+    This function is used to time a pipeline stage, count its errors and, when tracing is enabled,
+    record it as a span of the current request trace.
+    Args:
+        stage: name of the stage
+        attributes: extra span attributes
+    """
+    started = time.perf_counter()
+    span_context = TRACER.start_as_current_span(stage, attributes=attributes) if TRACER is not None else nullcontext()
+    with span_context as span:
+        try:
+            yield span
+        except Exception:
+            ERRORS.inc(stage=stage)
+            raise
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+
+def record_token_usage(use: str, usage_metadata):
+    """
+    This function is used to count the prompt and completion tokens of an Azure OpenAI call.
+    Args:
+        use: what the model was called for (chat, qa)
+        usage_metadata: the usage_metadata of the langchain message, may be None
+    """
+    if not usage_metadata:
+        return
+    LLM_TOKENS.inc(usage_metadata.get("input_tokens", 0), use=use, kind="prompt")
+    LLM_TOKENS.inc(usage_metadata.get("output_tokens", 0), use=use, kind="completion")
@@ -1,4 +1,8 @@
-from pydantic import BaseModel, field_validator
+import time
+import uuid
+from typing import Optional
+
+from pydantic import BaseModel, Field, field_validator
 
 
 class UserInfo(BaseModel):
@@ -28,3 +32,13 @@ class UserInfo(BaseModel):
         if v is not None and (v < 0 or v > 120):
             raise ValueError('Age must be between 0 and 120')
         return v
+
+
+class ChatSession(BaseModel):
+    session_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    messages: list = Field(default_factory=list)
+    user_info: dict = Field(default_factory=dict)
+    missing_fields: list = Field(default_factory=list)
+    # Field the last answer asked for, a bare number in the next turn answers it
+    asked_field: Optional[str] = None
+    updated_at: float = Field(default_factory=time.time)
@@ -1,3 +1,5 @@
+import json
+
 from phase_2.backend.models import UserInfo
 
 
@@ -26,7 +28,7 @@ class PromptTemplates:
     - Use a conversational, polite, and friendly tone.
     - Validate all user inputs.
     - If the user input is invalid, politely explain the requirement **in the user's language** using the exact validation messages.
-    - If some required information is missing, ask for it naturally and conversationally.
+    - If some required information is missing, ask for it naturally and conversationally, starting with "next_field" of the current state.
     - When all required info is collected and valid, provide a clear summary of the user’s information and ask for confirmation.
     - If the user confirms, acknowledge and do not ask for confirmation again.
     - First, detect the language of the user’s question.
@@ -82,10 +84,14 @@ class PromptTemplates:
       }},
       "missing_fields": []
     }}
+    """
+
+    INFO_COLLECTION_STATE_PROMPT = """
+    CURRENT STATE OF THE CONVERSATION:
+    {state}
     
-    {user_prompt}
-    
-    {{
+    Only the most recent messages are shown, this state holds every detail collected before them.
+    Start from this state, update it with the user's new message and always return the full user_info.
     """
 
     QA_SYSTEM_PROMPT = """
@@ -124,6 +130,21 @@ class PromptTemplates:
     REMINDER: Respond in the same language as the user's question above!
     """
 
+    @staticmethod
+    def get_info_collection_system_prompt() -> str:
+        return PromptTemplates.INFO_COLLECTION_SYSTEM_PROMPT.format()
+
+    @staticmethod
+    def get_info_collection_state_prompt(user_info: dict, missing_fields: list) -> str:
+        state = {
+            "user_info": user_info,
+            "missing_fields": missing_fields,
+            "next_field": missing_fields[0] if missing_fields else None,
+            "is_confirmed": bool(user_info.get("is_confirmed")),
+            "awaiting_confirmation": not missing_fields and not user_info.get("is_confirmed"),
+        }
+        return PromptTemplates.INFO_COLLECTION_STATE_PROMPT.format(state=json.dumps(state, ensure_ascii=False, indent=2))
+
     @staticmethod
     def get_qa_prompt(user_info: UserInfo, user_prompt, knowledge_content: str) -> str:
         return PromptTemplates.QA_SYSTEM_PROMPT.format(
@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from phase_2.backend.models import ChatSession
+from config import SESSION_STORE_BACKEND, SESSION_STORE_REDIS_URL, SESSION_TTL_SECONDS, SESSION_MAX_SESSIONS
+
+
+class InMemorySessionStore:
+    """
+    In-process session store, sessions expire after ttl_seconds without activity and the oldest sessions
+    are dropped above max_sessions.
+    """
+
+    def __init__(self, ttl_seconds: float, max_sessions: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, session_id: str) -> Optional[ChatSession]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if session.updated_at + self.ttl_seconds < time.time():
+                del self._sessions[session_id]
+                return None
+            return session.model_copy(deep=True)
+
+    async def save(self, session: ChatSession):
+        session.updated_at = time.time()
+        with self._lock:
+            self._sessions[session.session_id] = session.model_copy(deep=True)
+            self._sessions.move_to_end(session.session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    async def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class RedisSessionStore:
+    """
+    Redis session store, lets every backend worker serve every session.
+    """
+
+    def __init__(self, url: str, ttl_seconds: float, prefix: str = "chat-session:"):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url, decode_responses=True)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    async def get(self, session_id: str) -> Optional[ChatSession]:
+        value = await self.client.get(self.prefix + session_id)
+        return ChatSession.model_validate_json(value) if value else None
+
+    async def save(self, session: ChatSession):
+        session.updated_at = time.time()
+        await self.client.set(self.prefix + session.session_id, session.model_dump_json(), ex=int(self.ttl_seconds))
+
+    async def delete(self, session_id: str):
+        await self.client.delete(self.prefix + session_id)
+
+
+def create_session_store():
+    """
+    This function is used to build the session store from the configuration.
+
+    Returns: InMemorySessionStore or RedisSessionStore
+    """
+    if SESSION_STORE_BACKEND == "redis":
+        return RedisSessionStore(SESSION_STORE_REDIS_URL, SESSION_TTL_SECONDS)
+    return InMemorySessionStore(SESSION_TTL_SECONDS, SESSION_MAX_SESSIONS)
+
+
+# Global object
+SESSION_STORE = create_session_store()
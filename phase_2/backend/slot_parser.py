@@ -0,0 +1,209 @@
+import re
+from typing import Optional
+
+from phase_2.backend.hmo_plans import normalize_hmo, normalize_tier
+from phase_2.backend.models import ChatSession, UserInfo
+
+# Fields collected in the info collection phase, in the order they are asked for
+REQUIRED_FIELDS = ["full_name", "id_number", "gender", "age", "hmo_name", "hmo_card_number", "membership_tier"]
+
+GENDERS = {
+    "male": ["male", "man", "m", "זכר", "גבר"],
+    "female": ["female", "woman", "f", "נקבה", "אישה", "אשה"],
+}
+YES_WORDS = {"yes", "y", "yeah", "yep", "ok", "okay", "sure", "confirm", "confirmed", "correct", "right", "approved",
+             "כן", "נכון", "אישור", "מאשר", "מאשרת", "מאושר", "בסדר", "אוקיי", "תקין"}
+# Words that may surround a slot value without changing its meaning
+FILLER_WORDS = {"my", "is", "i", "im", "i'm", "am", "and", "the", "a", "it", "its", "it's", "id", "number", "card",
+                "hmo", "tier", "plan", "membership", "insurance", "age", "years", "year", "old", "gender", "please",
+                "שלי", "אני", "מספר", "תעודת", "זהות", "ת.ז", "תז", "כרטיס", "קופה", "קופת", "חולים", "מסלול", "גיל",
+                "בן", "בת", "שנים", "שנה", "מין", "הוא", "היא"}
+
+DISPLAY_NAMES = {
+    "en": {"מכבי": "Maccabi", "מאוחדת": "Meuhedet", "כללית": "Clalit", "זהב": "Gold", "כסף": "Silver",
+           "ארד": "Bronze", "male": "male", "female": "female"},
+    "he": {"מכבי": "מכבי", "מאוחדת": "מאוחדת", "כללית": "כללית", "זהב": "זהב", "כסף": "כסף", "ארד": "ארד",
+           "male": "זכר", "female": "נקבה"},
+}
+FIELD_QUESTIONS = {
+    "en": {"full_name": "What is your first and last name?",
+           "id_number": "What is your ID number (9 digits)?",
+           "gender": "What is your gender (male/female)?",
+           "age": "How old are you?",
+           "hmo_name": "Which HMO are you a member of (Maccabi, Meuhedet or Clalit)?",
+           "hmo_card_number": "What is your HMO card number (9 digits)?",
+           "membership_tier": "What is your membership tier (Gold, Silver or Bronze)?"},
+    "he": {"full_name": "מה השם הפרטי ושם המשפחה שלך?",
+           "id_number": "מה מספר תעודת הזהות שלך (9 ספרות)?",
+           "gender": "מה המין שלך (זכר/נקבה)?",
+           "age": "בן/בת כמה את/ה?",
+           "hmo_name": "באיזו קופת חולים את/ה חבר/ה (מכבי, מאוחדת או כללית)?",
+           "hmo_card_number": "מה מספר כרטיס הקופה שלך (9 ספרות)?",
+           "membership_tier": "מה מסלול הביטוח שלך (זהב, כסף או ארד)?"},
+}
+FIELD_LABELS = {
+    "en": {"full_name": "Name", "id_number": "ID number", "gender": "Gender", "age": "Age", "hmo_name": "HMO",
+           "hmo_card_number": "HMO card number", "membership_tier": "Membership tier"},
+    "he": {"full_name": "שם", "id_number": "תעודת זהות", "gender": "מין", "age": "גיל", "hmo_name": "קופת חולים",
+           "hmo_card_number": "מספר כרטיס קופה", "membership_tier": "מסלול ביטוח"},
+}
+MESSAGES = {
+    "en": {"thanks": "Thank you!", "summary": "Please confirm that your details are correct:",
+           "confirm_question": "Is everything correct?", "confirmed": "Thank you, your details are confirmed. "
+                                                                     "How can I help you with your medical services?"},
+    "he": {"thanks": "תודה!", "summary": "אנא אשר/י שהפרטים שלך נכונים:", "confirm_question": "האם הכל נכון?",
+           "confirmed": "תודה, הפרטים שלך אושרו. איך אפשר לעזור לך בנושא השירותים הרפואיים?"},
+}
+
+_TOKEN_RE = re.compile(r"[\w'.֐-׿]+")
+_HEBREW_RE = re.compile(r"[֐-׿]")
+
+
+def detect_language(text: str, session: ChatSession) -> str:
+    """
+    This function is used to detect the language of the turn, digits only turns use the language of the conversation.
+    """
+    for candidate in [text, *(message["content"] for message in reversed(session.messages) if message["role"] == "user")]:
+        if _HEBREW_RE.search(candidate):
+            return "he"
+        if re.search(r"[A-Za-z]", candidate):
+            return "en"
+    return "he"
+
+
+def get_missing_fields(user_info: dict) -> list:
+    return [field for field in REQUIRED_FIELDS if user_info.get(field) in (None, "")]
+
+
+# Fields a bare number may answer, and the number of digits each accepts
+NUMBER_FIELDS = {"id_number": range(9, 10), "hmo_card_number": range(9, 10), "age": range(1, 4)}
+
+
+def get_next_field(missing_fields: list) -> Optional[str]:
+    """
+    This function is used to pick the field the answer asks for next, the missing fields are asked in order
+    both by the local path and by the model (see the "next_field" of the state prompt).
+    """
+    return missing_fields[0] if missing_fields else None
+
+
+def _normalize_gender(token: str) -> Optional[str]:
+    for gender, spellings in GENDERS.items():
+        if token in spellings:
+            return gender
+    return None
+
+
+def parse_slots(text: str, user_info: dict, asked_field: Optional[str] = None) -> Optional[dict]:
+    """
+    This function is used to read obvious slot values (ID and card numbers, age, gender, HMO, tier) from a user turn.
+    A bare number is only taken as the answer to the field last asked, or to the only number field still missing.
+    Args:
+        text: the user message
+        user_info: the details collected so far, used to know which field a bare number answers
+        asked_field: the field the last assistant message asked for
+
+    Returns: dict of the new slot values, or None when the turn holds anything that is not understood
+    """
+    missing = get_missing_fields(user_info)
+    slots = {}
+    numbers = []
+    for token in _TOKEN_RE.findall(text.casefold()):
+        token = token.strip(".'")
+        bare = token[1:] if token.startswith("ו") and len(token) > 1 else token
+        if not token or token in FILLER_WORDS:
+            continue
+        if token.isdigit():
+            numbers.append(token)
+        elif normalize_hmo(bare) and "hmo_name" not in slots:
+            slots["hmo_name"] = normalize_hmo(bare)
+        elif normalize_tier(bare) and "membership_tier" not in slots:
+            slots["membership_tier"] = normalize_tier(bare)
+        elif _normalize_gender(bare) and "gender" not in slots:
+            slots["gender"] = _normalize_gender(bare)
+        else:
+            return None
+
+    for number in numbers:
+        open_fields = [field for field in missing if field in NUMBER_FIELDS and field not in slots]
+        if asked_field in open_fields:
+            field = asked_field
+        elif len(open_fields) == 1:
+            field = open_fields[0]
+        else:
+            # The number may answer another question, or be a mistyped value, the model asks again
+            return None
+        if len(number) not in NUMBER_FIELDS[field]:
+            return None
+        slots[field] = int(number) if field == "age" else number
+
+    try:
+        if "id_number" in slots:
+            UserInfo.validate_id(slots["id_number"])
+        if "hmo_card_number" in slots:
+            UserInfo.validate_id(slots["hmo_card_number"])
+        if "age" in slots:
+            UserInfo.validate_age(slots["age"])
+    except ValueError:
+        # Invalid values are explained by the model in the user's own words
+        return None
+    return slots
+
+
+def _summary(user_info: dict, language: str) -> str:
+    labels = FIELD_LABELS[language]
+    lines = [f"- {labels[field]}: {user_info[field]}" for field in REQUIRED_FIELDS]
+    return "\n".join([MESSAGES[language]["summary"], *lines, MESSAGES[language]["confirm_question"]])
+
+
+def answer_locally(user_prompt: str, session: ChatSession) -> Optional[dict]:
+    """
+    This function is used to answer simple form filling turns without calling the LLM.
+    It handles slot values that can be read deterministically and yes confirmations of a complete summary,
+    free form or ambiguous turns (names, corrections, questions, invalid values) return None and go to the LLM.
+    The session is updated the same way the LLM path updates it.
+    Args:
+        user_prompt: the new user message
+        session: the server side conversation
+
+    Returns: Dict["content": str, "user_info": {}, "missing_fields": []] or None
+    """
+    text = (user_prompt or "").strip()
+    if not text:
+        return None
+    user_info = {field: "" for field in REQUIRED_FIELDS}
+    user_info.update({key: value for key, value in (session.user_info or {}).items() if value is not None})
+    user_info["is_confirmed"] = bool(user_info.get("is_confirmed"))
+    language = detect_language(text, session)
+    display = DISPLAY_NAMES[language]
+
+    words = {token.strip(".!'") for token in _TOKEN_RE.findall(text.casefold())}
+    if not get_missing_fields(user_info) and not user_info["is_confirmed"] and words and words <= YES_WORDS:
+        user_info["is_confirmed"] = True
+        content = MESSAGES[language]["confirmed"]
+    else:
+        # Sessions saved before the asked field was kept fall back to the first missing field
+        asked_field = session.asked_field or get_next_field(get_missing_fields(user_info))
+        slots = parse_slots(text, user_info, asked_field)
+        if not slots:
+            return None
+        for field, value in slots.items():
+            value = display.get(value, value) if isinstance(value, str) else value
+            if user_info.get(field) not in ("", None, value):
+                # A changed detail needs a new confirmation
+                user_info["is_confirmed"] = False
+            user_info[field] = value
+
+        missing = get_missing_fields(user_info)
+        if missing:
+            content = f"{MESSAGES[language]['thanks']} {FIELD_QUESTIONS[language][get_next_field(missing)]}"
+        else:
+            content = _summary(user_info, language)
+
+    response = {"content": content, "user_info": user_info, "missing_fields": get_missing_fields(user_info)}
+    session.messages.append({"role": "user", "content": user_prompt})
+    session.messages.append({"role": "assistant", "content": content})
+    session.user_info = user_info
+    session.missing_fields = response["missing_fields"]
+    session.asked_field = get_next_field(response["missing_fields"])
+    return response
@@ -0,0 +1,54 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from config import EMBEDDING_MODEL, OFFLINE_STARTUP
+
+# Duration in seconds of every startup phase, in the order they ran
+STARTUP_TIMINGS = {}
+# Set once every startup phase finished, the /ready endpoint reports it
+READY = threading.Event()
+STARTUP_ERROR = None
+
+
+@contextmanager
+def startup_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = round(time.perf_counter() - started, 3)
+        logging.info("Startup phase %s took %.3fs", name, STARTUP_TIMINGS[name])
+
+
+def run_startup(offline: bool = OFFLINE_STARTUP):
+    """
+    This function is used to run the slow startup work: importing the LLM libraries, creating the Azure clients,
+    loading the tokenizer and the knowledge base index. It runs in a worker thread while the server already answers
+    /healthz, and marks the process ready when it is done.
+    Args:
+        offline: load only the prebuilt artifacts, without reading the knowledge base files or the network
+    """
+    global STARTUP_ERROR
+    started = time.perf_counter()
+    try:
+        with startup_phase("azure_clients"):
+            from phase_2.backend.azure_clients import init_clients
+            init_clients()
+        with startup_phase("tokenizer"):
+            # The embeddings client counts tokens with the tokenizer of the embedding model
+            from phase_2.backend.context_packer import get_encoding
+            get_encoding()
+            get_encoding(EMBEDDING_MODEL)
+        with startup_phase("knowledge_base"):
+            from phase_2.backend.vector_store_loader import load_vector_store_once
+            load_vector_store_once(offline=offline)
+        with startup_phase("llm_client"):
+            import phase_2.llm_client  # noqa: F401
+    except Exception as e:
+        STARTUP_ERROR = f"{type(e).__name__}: {e}"
+        logging.exception("Startup failed")
+        return
+    READY.set()
+    logging.info("Backend ready in %.3fs (offline=%s)", time.perf_counter() - started, offline)
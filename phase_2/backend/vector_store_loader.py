@@ -1,24 +1,387 @@
+import fcntl
+import hashlib
+import json
 import logging
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, NamedTuple, Optional
+
+import numpy as np
+
+from phase_2.backend.ann_index import apply_search_settings, build_index, get_index_settings
+from phase_2.backend.azure_clients import get_embeddings
+from phase_2.backend.embedding_stage import embed_texts, text_key
+from phase_2.backend.html_loader import get_splitter_settings, load_html_files
+from phase_2.backend.lexical_index import BM25Index
+from phase_2.backend.metrics import track_stage
+from config import EMBEDDING_MODEL, KB_DATA_DIR, KB_INDEX_DIR, OFFLINE_STARTUP
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
+# Bump this whenever the on-disk layout of the index changes, old artifacts are then rebuilt from scratch
+ARTIFACT_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.sqlite"
+
+
+class IndexSnapshot(NamedTuple):
+    """
+    Loaded knowledge base index. A reload builds a new snapshot and swaps it in with one assignment, requests keep
+    the snapshot they started with until they end (see lease_snapshot).
+    """
+    vector_store: "FAISS"
+    # BM25 index over the same chunks as vector_store
+    lexical_index: BM25Index
+    # Content version of the index, changes whenever a source file or the index settings change
+    version: str
 
-from langchain_community.vectorstores import FAISS
-from langchain_openai.embeddings import AzureOpenAIEmbeddings
-from html_loader import load_knowledgebase
-from config import AZURE_API_VERSION, AZURE_OPENAI_KEY, AZURE_OPENAI_ENDPOINT
 
 # Global object
-VECTOR_STORE = None
-
-
-def load_vector_store_once():
-    global VECTOR_STORE
-    if VECTOR_STORE is None:
-        logging.info("Loading HTML documents and creating vector store...")
-        docs = load_knowledgebase()
-        embedding_model = AzureOpenAIEmbeddings(
-            model="text-embedding-ada-002",
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,
-            api_key=AZURE_OPENAI_KEY,
-            api_version=AZURE_API_VERSION)
-        VECTOR_STORE = FAISS.from_documents(docs, embedding=embedding_model)
-        logging.info("Vector store loaded.")
-    return VECTOR_STORE
+SNAPSHOT: Optional[IndexSnapshot] = None
+_LOAD_LOCK = threading.Lock()
+_RELOAD_LOCK = threading.Lock()
+# Requests using each snapshot (by id), and the replaced snapshots waiting for their last request to close them
+_LEASES: Dict[int, int] = {}
+_RETIRED: Dict[int, IndexSnapshot] = {}
+_LEASE_LOCK = threading.Lock()
+
+
+def get_artifact_dir() -> Path:
+    return Path(KB_INDEX_DIR) / f"faiss_v{ARTIFACT_VERSION}"
+
+
+def hash_file(path: Path) -> str:
+    """
+    This function is used to calculate the content hash of a knowledge base source file.
+    Args:
+        path: path of the file
+
+    Returns: sha256 hex digest of the file bytes
+    """
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def scan_source_files(data_dir=KB_DATA_DIR) -> dict:
+    """
+    This function is used to hash every html file in the knowledge base folder.
+
+    Returns: Dict[file name, sha256]
+    """
+    return {html_file.name: hash_file(html_file) for html_file in sorted(Path(data_dir).glob("*.html"))}
+
+
+def _index_settings() -> dict:
+    return {"artifact_version": ARTIFACT_VERSION, "embedding_model": EMBEDDING_MODEL, **get_splitter_settings()}
+
+
+def get_index_version(manifest: dict) -> str:
+    """
+    This function is used to derive a short version id of the index from its manifest.
+    Args:
+        manifest: the index manifest
+
+    Returns: hex digest identifying the indexed content
+    """
+    content = {"settings": manifest["settings"], "index": manifest.get("index"),
+               "files": {name: entry["sha256"] for name, entry in sorted(manifest["files"].items())}}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _read_manifest(artifact_dir: Path):
+    manifest_path = artifact_dir / MANIFEST_FILE
+    if not manifest_path.exists():
+        return None
+    try:
+        return json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        logging.warning("Cannot read index manifest %s, rebuilding the index", manifest_path)
+        return None
+
+
+def _save_artifact(chunks: list, manifest: dict, artifact_dir: Path):
+    """
+    This function is used to write the index, chunk store and manifest next to the current artifact and swap them in,
+    so a crash in the middle never leaves a half written index behind.
+    Workers that still have the previous artifact open keep reading it until they reload.
+    """
+    import faiss
+    from phase_2.backend.chunk_store import write_chunk_store
+
+    tmp_dir = artifact_dir.with_name(artifact_dir.name + ".tmp")
+    old_dir = artifact_dir.with_name(artifact_dir.name + ".old")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    embeddings = np.vstack([embedding for _, _, _, embedding in chunks]).astype(np.float32)
+    index = build_index(embeddings, manifest["index"])
+    faiss.write_index(index, str(tmp_dir / INDEX_FILE))
+    write_chunk_store(tmp_dir / CHUNKS_FILE, chunks)
+    (tmp_dir / MANIFEST_FILE).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    if artifact_dir.exists():
+        artifact_dir.rename(old_dir)
+    tmp_dir.rename(artifact_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def open_vector_store(artifact_dir: Path) -> "FAISS":
+    """
+    This function is used to open a saved index read-only: the FAISS vectors are memory mapped and the chunks are
+    read from the SQLite chunk store on demand, so every worker process shares the same pages of the OS cache.
+    Args:
+        artifact_dir: folder of the persisted index
+
+    Returns: FAISS vector store
+    """
+    import faiss
+    from langchain_community.vectorstores import FAISS
+    from phase_2.backend.chunk_store import ChunkStore
+
+    with track_stage("index_open"):
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        index = apply_search_settings(faiss.read_index(str(artifact_dir / INDEX_FILE), mmap_flag | faiss.IO_FLAG_READ_ONLY))
+        docstore = ChunkStore(artifact_dir / CHUNKS_FILE)
+    return FAISS(get_embeddings(), index, docstore, dict(enumerate(docstore.ids())))
+
+
+@contextmanager
+def _build_lock(artifact_dir: Path):
+    """
+    This function is used to let a single process build the index, the other workers wait for it and then
+    open the saved artifact without any embedding call.
+    """
+    artifact_dir.parent.mkdir(parents=True, exist_ok=True)
+    with open(artifact_dir.with_name(artifact_dir.name + ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _is_compatible(manifest, artifact_dir: Path) -> bool:
+    return (manifest is not None and manifest.get("settings") == _index_settings()
+            and (artifact_dir / INDEX_FILE).exists() and (artifact_dir / CHUNKS_FILE).exists())
+
+
+def build_or_update_vector_store(data_dir=KB_DATA_DIR, artifact_dir=None):
+    """
+    This function is used to open the persisted index and re-embed only the files that were added or changed
+    since it was saved, the stored embeddings of the other files are reused. When there is no compatible artifact
+    the whole knowledge base is embedded once and saved.
+    Args:
+        data_dir: folder of the html files
+        artifact_dir: folder of the persisted index
+
+    Returns: tuple of the FAISS vector store and its manifest
+    """
+    from phase_2.backend.chunk_store import ChunkStore
+
+    data_dir = Path(data_dir)
+    artifact_dir = Path(artifact_dir) if artifact_dir else get_artifact_dir()
+    with _build_lock(artifact_dir):
+        current_files = scan_source_files(data_dir)
+        manifest = _read_manifest(artifact_dir)
+        if not _is_compatible(manifest, artifact_dir):
+            manifest = {"settings": _index_settings(), "files": {}}
+        indexed_files = manifest["files"]
+        # A new index type is built from the stored embeddings, nothing is embedded again
+        index_changed = manifest.get("index") != get_index_settings()
+        manifest["index"] = get_index_settings()
+
+        unchanged_files = [name for name, file_hash in current_files.items()
+                           if name in indexed_files and indexed_files[name]["sha256"] == file_hash]
+        new_files = [name for name in current_files if name not in unchanged_files]
+        stale_files = [name for name in indexed_files if name not in unchanged_files]
+
+        if indexed_files and not new_files and not stale_files and not index_changed:
+            logging.info("Vector store opened from %s, knowledge base is up to date.", artifact_dir)
+            return open_vector_store(artifact_dir), manifest
+
+        chunks_by_file = {}
+        if unchanged_files:
+            chunk_store = ChunkStore(artifact_dir / CHUNKS_FILE)
+            try:
+                chunks_by_file = {name: chunk_store.file_chunks(name) for name in unchanged_files}
+            finally:
+                chunk_store.close()
+
+        docs_by_file = load_html_files([data_dir / name for name in new_files])
+        new_docs = [doc for name in new_files for doc in docs_by_file[name]]
+        logging.info("Embedding %d chunks from %d files (%d stale files removed, %d files reused)",
+                     len(new_docs), len(new_files), len(stale_files), len(unchanged_files))
+        # Chunks with the same text as an indexed chunk (shared headers and footers) reuse its embedding
+        known = {text_key(doc.page_content): embedding
+                 for file_chunks in chunks_by_file.values() for _, _, doc, embedding in file_chunks}
+        with track_stage("index_embedding", chunks=len(new_docs)):
+            embeddings = embed_texts(get_embeddings(), [doc.page_content for doc in new_docs], known)
+        embeddings = iter(embeddings)
+        for name in new_files:
+            ids = [f"{name}:{current_files[name][:16]}:{i}" for i in range(len(docs_by_file[name]))]
+            chunks_by_file[name] = [(chunk_id, name, doc, next(embeddings))
+                                    for chunk_id, doc in zip(ids, docs_by_file[name])]
+            indexed_files[name] = {"sha256": current_files[name], "ids": ids}
+        for name in stale_files:
+            if name not in current_files:
+                indexed_files.pop(name)
+
+        chunks = [chunk for name in sorted(chunks_by_file) for chunk in chunks_by_file[name]]
+        if not chunks:
+            raise RuntimeError(f"No knowledge base chunks found in {data_dir}")
+        with track_stage("index_save"):
+            _save_artifact(chunks, manifest, artifact_dir)
+        return open_vector_store(artifact_dir), manifest
+
+
+def build_lexical_index(vector_store: "FAISS") -> BM25Index:
+    """
+    This function is used to build the BM25 index over the chunks of the vector store, in the order of the FAISS index.
+    The chunk texts are streamed from the chunk store, only the term statistics stay in memory.
+    Args:
+        vector_store: FAISS vector store
+
+    Returns: BM25Index
+    """
+    return BM25Index(vector_store.docstore)
+
+
+def load_prebuilt_vector_store(artifact_dir=None):
+    """
+    This function is used to load the persisted index as it is, without reading the knowledge base files
+    or calling the embedding service, for containers that ship the index built ahead of time.
+    Args:
+        artifact_dir: folder of the persisted index
+
+    Returns: tuple of the FAISS vector store and its manifest
+    """
+    artifact_dir = Path(artifact_dir) if artifact_dir else get_artifact_dir()
+    manifest = _read_manifest(artifact_dir)
+    if not _is_compatible(manifest, artifact_dir):
+        raise RuntimeError(f"No prebuilt index compatible with this version in {artifact_dir}, "
+                           f"run `python phase_2/backend/build_artifacts.py` first")
+    if manifest.get("index") != get_index_settings():
+        logging.warning("The prebuilt index is a %s index, not the configured %s one", manifest.get("index"),
+                        get_index_settings())
+    return open_vector_store(artifact_dir), manifest
+
+
+def _make_snapshot(vector_store: "FAISS", manifest: dict) -> IndexSnapshot:
+    with track_stage("lexical_index_build"):
+        lexical_index = build_lexical_index(vector_store)
+    return IndexSnapshot(vector_store, lexical_index, get_index_version(manifest))
+
+
+def _close_snapshot(snapshot: IndexSnapshot):
+    logging.info("Closing the replaced index version %s.", snapshot.version)
+    snapshot.vector_store.docstore.close()
+
+
+def _swap_snapshot(snapshot: IndexSnapshot) -> Optional[IndexSnapshot]:
+    """
+    This function is used to make a snapshot the current one. The replaced snapshot is closed right away when no
+    request uses it, else by the last request that releases it.
+
+    Returns: the replaced snapshot
+    """
+    global SNAPSHOT
+    with _LEASE_LOCK:
+        previous, SNAPSHOT = SNAPSHOT, snapshot
+        if previous is None or previous is snapshot:
+            return previous
+        if _LEASES.get(id(previous)):
+            _RETIRED[id(previous)] = previous
+            return previous
+    _close_snapshot(previous)
+    return previous
+
+
+@contextmanager
+def lease_snapshot() -> Iterator[Optional[IndexSnapshot]]:
+    """
+    This function is used to hold the current snapshot for the length of a request, a reload does not close its
+    chunk store before the request releases it.
+
+    Returns: context manager of the current snapshot, None when the index is not loaded yet
+    """
+    with _LEASE_LOCK:
+        snapshot = SNAPSHOT
+        if snapshot is not None:
+            _LEASES[id(snapshot)] = _LEASES.get(id(snapshot), 0) + 1
+    try:
+        yield snapshot
+    finally:
+        if snapshot is not None:
+            retired = None
+            with _LEASE_LOCK:
+                _LEASES[id(snapshot)] -= 1
+                if not _LEASES[id(snapshot)]:
+                    del _LEASES[id(snapshot)]
+                    retired = _RETIRED.pop(id(snapshot), None)
+            if retired is not None:
+                _close_snapshot(retired)
+
+
+def set_snapshot(vector_store: "FAISS", manifest: dict) -> IndexSnapshot:
+    """
+    This function is used to make a loaded vector store the one every new request searches.
+    """
+    snapshot = _make_snapshot(vector_store, manifest)
+    _swap_snapshot(snapshot)
+    return snapshot
+
+
+def load_vector_store_once(offline: bool = OFFLINE_STARTUP) -> IndexSnapshot:
+    """
+    This function is used to load the knowledge base index once per process, concurrent callers wait for the first one.
+    Args:
+        offline: load the prebuilt index only, never re-embed the knowledge base
+
+    Returns: the loaded index snapshot
+    """
+    with _LOAD_LOCK:
+        if SNAPSHOT is None:
+            if offline:
+                logging.info("Loading the prebuilt vector store...")
+                vector_store, manifest = load_prebuilt_vector_store()
+            else:
+                logging.info("Loading HTML documents and creating vector store...")
+                vector_store, manifest = build_or_update_vector_store()
+            set_snapshot(vector_store, manifest)
+            logging.info("Vector store loaded (index version %s).", SNAPSHOT.version)
+    return SNAPSHOT
+
+
+def reload_vector_store(offline: bool = OFFLINE_STARTUP) -> bool:
+    """
+    This function is used to pick up knowledge base changes while serving: only the added or changed files are
+    embedded again (or, offline, the prebuilt index is reopened), then the new snapshot replaces the old one at once.
+    Requests that already hold the old snapshot finish on it, its chunk store is closed once the last one released it.
+    Args:
+        offline: reopen the prebuilt index only, never re-embed the knowledge base
+
+    Returns: True when a new index version was swapped in, False when nothing changed or a reload is running
+    """
+    if not _RELOAD_LOCK.acquire(blocking=False):
+        logging.info("A knowledge base reload is already running.")
+        return False
+    try:
+        with track_stage("index_reload"):
+            if offline:
+                vector_store, manifest = load_prebuilt_vector_store()
+            else:
+                vector_store, manifest = build_or_update_vector_store()
+            if SNAPSHOT is not None and get_index_version(manifest) == SNAPSHOT.version:
+                vector_store.docstore.close()
+                return False
+            snapshot = _make_snapshot(vector_store, manifest)
+            previous = _swap_snapshot(snapshot)
+        logging.info("Knowledge base reloaded, index version %s -> %s.",
+                     previous.version if previous is not None else None, snapshot.version)
+        return True
+    finally:
+        _RELOAD_LOCK.release()
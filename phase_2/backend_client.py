@@ -0,0 +1,87 @@
+import json
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (BACKEND_URL, BACKEND_POOL_SIZE, BACKEND_CONNECT_TIMEOUT, BACKEND_READ_TIMEOUT,
+                    BACKEND_MAX_RETRIES, BACKEND_RETRY_BACKOFF)
+
+
+class BackendClient:
+    """
+    HTTP client of the backend shared by every session of a Streamlit server process.
+    The connections are pooled and kept alive, every request has a connect and a read timeout, and requests the
+    backend did not process (connection refused, 503 while it starts or when its Azure OpenAI queue is full)
+    are retried with exponential backoff, honouring the Retry-After header.
+    """
+
+    def __init__(self, base_url: str = BACKEND_URL, pool_size: int = BACKEND_POOL_SIZE,
+                 connect_timeout: float = BACKEND_CONNECT_TIMEOUT, read_timeout: float = BACKEND_READ_TIMEOUT,
+                 max_retries: int = BACKEND_MAX_RETRIES, retry_backoff: float = BACKEND_RETRY_BACKOFF):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        # A request that timed out while reading may have been processed, it is not sent again
+        retry = Retry(total=max_retries, connect=max_retries, read=0, status=max_retries,
+                      status_forcelist=(503,), allowed_methods=None, backoff_factor=retry_backoff,
+                      respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Pre-warm requests run in the background, the user is not kept waiting for them
+        self._background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="backend-warmup")
+
+    def _post(self, path: str, payload: dict, **kwargs) -> requests.Response:
+        return self.session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout, **kwargs)
+
+    def chat(self, session_id, user_prompt: str) -> dict:
+        """
+        This function is used to send one message of the info collection conversation.
+        Args:
+            session_id: session id of the previous answer, None for a new conversation
+            user_prompt: the new user message
+
+        Returns: the backend answer, see POST /chat
+        """
+        response = self._post("/chat", {"session_id": session_id, "user_prompt": user_prompt})
+        response.raise_for_status()
+        return response.json()
+
+    def stream_qa(self, user_prompt: str, user_info: dict):
+        """
+        This function is used to read the streamed QA answer and yield its events as they arrive.
+        The read timeout applies to every line, a stalled stream fails instead of hanging.
+
+        Returns: generator of the NDJSON events, see POST /qa/stream
+        """
+        with self._post("/qa/stream", {"user_prompt": user_prompt, "user_info": user_info}, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield json.loads(line)
+
+    def warm_up_qa(self, user_info: dict) -> Future:
+        """
+        This function is used to prepare the QA phase in the background as soon as the user info is confirmed,
+        the backend loads the index and the user's plan filter while the user types the first question.
+
+        Returns: future of the backend answer, None when the warm-up failed
+        """
+        def warm_up():
+            try:
+                response = self._post("/qa/warmup", {"user_info": user_info})
+                response.raise_for_status()
+                return response.json()
+            except requests.RequestException as e:
+                # The first question does the same work, a failed warm-up only loses the head start
+                logging.warning("QA warm-up failed: %s", e)
+                return None
+
+        return self._background.submit(warm_up)
+
+
+# Global object
+BACKEND_CLIENT = BackendClient()
@@ -1,21 +1,43 @@
+import asyncio
 import json
 import logging
+import time
 import traceback
+from contextlib import aclosing, asynccontextmanager
 
-from langchain.chains import RetrievalQA
-from langchain_core.prompts import PromptTemplate
-from langchain_openai import AzureChatOpenAI
-from langchain.chains import create_retrieval_chain
+import numpy as np
 
-from phase_2.backend.models import UserInfo
+from phase_2.backend.answer_cache import ANSWER_CACHE
+from phase_2.backend.azure_clients import get_chat_llm, get_qa_llm
+from phase_2.backend.azure_scheduler import CHAT_SCHEDULER, estimate_tokens
+from phase_2.backend.context_packer import pack_context
+from phase_2.backend.embedding_cache import QUERY_EMBEDDING_CACHE
+from phase_2.backend.hmo_plans import normalize_hmo, normalize_tier, plan_filter
+from phase_2.backend.lexical_index import reciprocal_rank_fusion
+from phase_2.backend.metrics import RETRIEVED_CHUNKS, STAGE_SECONDS, record_token_usage, track_stage
+from phase_2.backend.models import ChatSession, UserInfo
 from phase_2.backend.prompt_templates import PromptTemplates
-from phase_2.backend.vector_store_loader import load_vector_store_once
-from config import AZURE_API_VERSION, AZURE_OPENAI_KEY, AZURE_OPENAI_ENDPOINT, OPENAI_ENGINE
+from phase_2.backend.slot_parser import REQUIRED_FIELDS, get_missing_fields, get_next_field
+from phase_2.backend import vector_store_loader
+from config import (CHAT_COMPLETION_TOKENS_ESTIMATE, CHAT_HISTORY_WINDOW, QA_COMPLETION_TOKENS_ESTIMATE,
+                    QA_CONTEXT_TOKEN_BUDGET)
 
+# Retrieval settings of the QA phase
+QA_RETRIEVAL_K = 8
+QA_SCORE_THRESHOLD = 0.8
+# Number of nearest chunks searched before keeping the ones of the user's plan
+QA_FETCH_K = 60
 
-def extract_user_info_with_gpt(user_prompt, messages: list) -> UserInfo:
+
+async def extract_user_info_with_gpt(user_prompt, session: ChatSession) -> dict:
     """
     This function is used to extract user info with gpt.
+    The prompt holds the system prompt, the structured state of the collected details and only the last
+    CHAT_HISTORY_WINDOW messages, so its size stays the same however long the conversation runs.
+    The new user message and the assistant answer are appended to the session.
+    Args:
+        user_prompt: the new user message
+        session: the server side conversation
 
     Returns: Dict["context": {}, "user_info": {}, "missing_fields": []]
     """
@@ -25,57 +47,210 @@ def extract_user_info_with_gpt(user_prompt, messages: list) -> UserInfo:
         "missing_fields": []
     }
 
-    info_prompt_template = PromptTemplate(
-        input_variables=['user_prompt'],
-        template=PromptTemplates.INFO_COLLECTION_SYSTEM_PROMPT
-    )
-    messages.append({"role": "user", "content": info_prompt_template.format(user_prompt=user_prompt)})
+    user_info = {field: "" for field in REQUIRED_FIELDS}
+    user_info.update(session.user_info or {})
+    user_info["is_confirmed"] = bool(user_info.get("is_confirmed"))
+    messages = [
+        {"role": "system", "content": PromptTemplates.get_info_collection_system_prompt()},
+        {"role": "system", "content": PromptTemplates.get_info_collection_state_prompt(user_info, get_missing_fields(user_info))},
+        *session.messages[-CHAT_HISTORY_WINDOW:],
+        {"role": "user", "content": user_prompt},
+    ]
 
-    llm = AzureChatOpenAI(
-        azure_endpoint=AZURE_OPENAI_ENDPOINT,
-        api_key=AZURE_OPENAI_KEY,
-        api_version=AZURE_API_VERSION,
-        model=OPENAI_ENGINE,
-        temperature=0
-    ).bind(response_format={"type": "json_object"})
+    llm = get_chat_llm().bind(response_format={"type": "json_object"})
+    estimated_tokens = estimate_tokens(*(message["content"] for message in messages),
+                                       completion_tokens=CHAT_COMPLETION_TOKENS_ESTIMATE)
 
-    response = llm.invoke(messages)
+    with track_stage("chat_llm"):
+        response = await CHAT_SCHEDULER.run(lambda: llm.ainvoke(messages), estimated_tokens)
+    record_token_usage("chat", response.usage_metadata)
 
     # Attempt to parse the response content as JSON
     try:
         response_format = json.loads(response.content)
     except json.JSONDecodeError:
-        logging.error("Cannot load the response content", traceback.format_exc())
+        logging.error("Cannot load the response content: %s", traceback.format_exc())
+
+    # Details the model left empty keep their collected value, a failed turn never loses the state
+    for field, value in (response_format.get("user_info") or {}).items():
+        if value not in ("", None):
+            user_info[field] = value
+    response_format["user_info"] = user_info
+    response_format["missing_fields"] = get_missing_fields(user_info)
 
+    session.messages.append({"role": "user", "content": user_prompt})
+    session.messages.append({"role": "assistant", "content": response_format.get("content", "")})
+    session.user_info = user_info
+    session.missing_fields = response_format["missing_fields"]
+    session.asked_field = get_next_field(response_format["missing_fields"])
     return response_format
 
 
-def get_qa_chain_response(user_prompt, user_info: dict):
+async def retrieve_documents(vector_store, query_embedding, user_info: UserInfo = None) -> list:
     """
-    This function is used to get the QA response from GPT,
+    This function is used to retrieve the knowledge base chunks relevant to an already embedded question,
+    it keeps the same similarity score threshold as the retriever used before.
+    When the user info is given only the chunks of the user's HMO and membership tier (and the general chunks) are kept.
+    Args:
+        vector_store: FAISS vector store
+        query_embedding: embedding of the user question
+        user_info: the confirmed user info
+
+    Returns: list of (Document, relevance score) tuples
+    """
+    metadata_filter = plan_filter(user_info.hmo_name, user_info.membership_tier) if user_info else None
+    relevance_score_fn = vector_store._select_relevance_score_fn()
+    docs_and_scores = await vector_store.asimilarity_search_with_score_by_vector(
+        query_embedding, k=QA_RETRIEVAL_K, filter=metadata_filter, fetch_k=QA_FETCH_K)
+    docs_and_relevance = [(doc, relevance_score_fn(score)) for doc, score in docs_and_scores]
+    return [(doc, relevance) for doc, relevance in docs_and_relevance if relevance >= QA_SCORE_THRESHOLD]
+
+
+@asynccontextmanager
+async def _use_snapshot():
+    """
+    This function is used to hold the current index snapshot while a request searches it, see lease_snapshot.
+    """
+    if vector_store_loader.SNAPSHOT is None:
+        # Only happens when the lifespan hook did not run, do not block the event loop while building the index
+        await asyncio.to_thread(vector_store_loader.load_vector_store_once)
+    with vector_store_loader.lease_snapshot() as snapshot:
+        # Only the current snapshot moves the cache to its version, a request still on a replaced one must not
+        if snapshot is vector_store_loader.SNAPSHOT:
+            await ANSWER_CACHE.set_index_version(snapshot.version)
+        yield snapshot
+
+
+async def warm_up_qa(user_info: dict) -> dict:
+    """
+    This function is used to prepare the QA phase of a user before the first question arrives: the index is loaded
+    and its memory mapped vectors are read into the page cache, and the user's plan is resolved.
+    Args:
+        user_info: the confirmed user info
+
+    Returns: dict of the index version and the HMO and membership tier the retrieval filters on
+    """
+    user_info = UserInfo(**user_info)
+    async with _use_snapshot() as snapshot:
+        with track_stage("qa_warmup"):
+            index = snapshot.vector_store.index
+            await asyncio.to_thread(index.search, np.zeros((1, index.d), dtype=np.float32), 1)
+    return {
+        "index_version": snapshot.version,
+        "hmo": normalize_hmo(user_info.hmo_name),
+        "membership_tier": normalize_tier(user_info.membership_tier),
+    }
+
+
+async def _prepare_qa_prompt(user_prompt, user_info: UserInfo):
+    """
+    This function is used to look the question up in the answer cache and, on a miss, retrieve the knowledge base
+    chunks and build the QA prompt. The similarity and BM25 results are merged with reciprocal rank fusion.
+
+    Returns: tuple of (cached answer, prompt, query embedding, index version), exactly one of cached answer and
+        prompt is not None
+    """
+    # The whole question is answered from one snapshot, even when a reload swaps the index meanwhile
+    async with _use_snapshot() as snapshot:
+        return await _build_qa_prompt(user_prompt, user_info, snapshot)
+
+
+async def _build_qa_prompt(user_prompt, user_info: UserInfo, snapshot: vector_store_loader.IndexSnapshot):
+    vector_store, lexical_index, index_version = snapshot
+    with track_stage("answer_cache"):
+        cached_answer = await ANSWER_CACHE.get(user_prompt, user_info.hmo_name, user_info.membership_tier)
+    if cached_answer is not None:
+        return cached_answer, None, None, index_version
+
+    metadata_filter = plan_filter(user_info.hmo_name, user_info.membership_tier)
+    with track_stage("lexical_search"):
+        lexical_docs = lexical_index.search(user_prompt, QA_RETRIEVAL_K, metadata_filter) if lexical_index else []
+    RETRIEVED_CHUNKS.observe(len(lexical_docs), source="lexical")
+    if lexical_index is not None and lexical_index.covers_query(user_prompt, lexical_docs):
+        # Keyword queries whose every word is found in the best chunk are answered from the lexical index alone
+        docs_and_scores, query_embedding = lexical_docs, None
+    else:
+        # The query embedding is computed once and used both for the semantic cache lookup and the retrieval
+        with track_stage("query_embedding"):
+            query_embedding = await QUERY_EMBEDDING_CACHE.embed_query(vector_store.embeddings, user_prompt)
+        with track_stage("semantic_cache"):
+            cached_answer = await ANSWER_CACHE.get_similar(query_embedding, user_info.hmo_name, user_info.membership_tier)
+        if cached_answer is not None:
+            return cached_answer, None, None, index_version
+
+        # Retrieve relevant documents based on user question to add context as knowledge base in my prompt
+        with track_stage("vector_search"):
+            semantic_docs = await retrieve_documents(vector_store, query_embedding, user_info)
+        RETRIEVED_CHUNKS.observe(len(semantic_docs), source="vector")
+        docs_and_scores = reciprocal_rank_fusion(semantic_docs, lexical_docs)[:QA_RETRIEVAL_K]
+    RETRIEVED_CHUNKS.observe(len(docs_and_scores), source="fused")
+
+    with track_stage("prompt_build"):
+        knowledge_content = pack_context(docs_and_scores, QA_CONTEXT_TOKEN_BUDGET)
+        customize_prompt = PromptTemplates.get_qa_prompt(user_info=user_info, knowledge_content=knowledge_content, user_prompt=user_prompt)
+    return None, customize_prompt, query_embedding, index_version
+
+
+async def get_qa_chain_response(user_prompt, user_info: dict):
+    """
+    This function is used to get the QA response from GPT, answers are served from the answer cache when the same
+    question (or a semantically equivalent one) was already answered for the same HMO and membership tier.
     Args:
         user_info:
 
     Returns:
 
     """
-    vector_store = load_vector_store_once()
-    retriever = vector_store.as_retriever(search_type="similarity_score_threshold", search_kwargs={'score_threshold': 0.8})
+    user_info = UserInfo(**user_info)
+    cached_answer, customize_prompt, query_embedding, index_version = await _prepare_qa_prompt(user_prompt, user_info)
+    if cached_answer is not None:
+        return cached_answer
 
-    # Retrieve relevant documents based on user question to add context as knowledge base in my prompt
-    docs = retriever.invoke(user_prompt)
+    # Users asking the same question at the same time share one completion
+    with track_stage("qa_llm"):
+        response = await CHAT_SCHEDULER.run(
+            lambda: get_qa_llm().ainvoke(customize_prompt),
+            estimate_tokens(customize_prompt, completion_tokens=QA_COMPLETION_TOKENS_ESTIMATE),
+            key=("qa", customize_prompt))
+    record_token_usage("qa", response.usage_metadata)
 
-    knowledge_content = "\n\n".join([doc.page_content for doc in docs])
-    customize_prompt = PromptTemplates.get_qa_prompt(user_info=UserInfo(**user_info), knowledge_content=knowledge_content, user_prompt=user_prompt)
+    await ANSWER_CACHE.set(user_prompt, user_info.hmo_name, user_info.membership_tier, response.content,
+                           query_embedding=query_embedding, index_version=index_version)
+    return response.content
 
-    llm = AzureChatOpenAI(
-        azure_endpoint=AZURE_OPENAI_ENDPOINT,
-        api_key=AZURE_OPENAI_KEY,
-        api_version=AZURE_API_VERSION,
-        model=OPENAI_ENGINE,
-        temperature=0.3,
-    )
 
-    response = llm.invoke(customize_prompt)
+async def stream_qa_chain_response(user_prompt, user_info: dict):
+    """
+    This function is used to stream the QA response from GPT token by token.
+    The full answer is cached only when the stream was consumed to the end.
+    Args:
+        user_prompt: the user question
+        user_info: the confirmed user info
 
-    return response.content
+    Returns: async generator of text chunks
+    """
+    user_info = UserInfo(**user_info)
+    cached_answer, customize_prompt, query_embedding, index_version = await _prepare_qa_prompt(user_prompt, user_info)
+    if cached_answer is not None:
+        yield cached_answer
+        return
+
+    answer_parts = []
+    usage_metadata = None
+    started = time.perf_counter()
+    stream = CHAT_SCHEDULER.stream(lambda: get_qa_llm().astream(customize_prompt),
+                                   estimate_tokens(customize_prompt, completion_tokens=QA_COMPLETION_TOKENS_ESTIMATE))
+    with track_stage("qa_llm"):
+        async with aclosing(stream):
+            async for chunk in stream:
+                if chunk.usage_metadata:
+                    usage_metadata = chunk.usage_metadata
+                if chunk.content:
+                    if not answer_parts:
+                        STAGE_SECONDS.observe(time.perf_counter() - started, stage="qa_llm_first_token")
+                    answer_parts.append(chunk.content)
+                    yield chunk.content
+    record_token_usage("qa", usage_metadata)
+
+    await ANSWER_CACHE.set(user_prompt, user_info.hmo_name, user_info.membership_tier, "".join(answer_parts),
+                           query_embedding=query_embedding, index_version=index_version)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Phase 1 modules import their package as `app`, like when they run from the phase_1 folder
+for path in (project_root, os.path.join(project_root, "phase_1")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
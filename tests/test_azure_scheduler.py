@@ -0,0 +1,57 @@
+import asyncio
+import email.utils
+import time
+
+import pytest
+
+from phase_2.backend.azure_scheduler import AzureScheduler, get_retry_after
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, headers: dict):
+        self.status_code = status_code
+        self.headers = headers
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code: int, headers: dict = None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = FakeResponse(status_code, headers or {})
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after": "3"}, 3.0),
+    ({"retry-after-ms": "1500", "retry-after": "3"}, 1.5),
+    ({}, 0.0),
+    # Malformed headers fall back to the backoff instead of raising
+    ({"retry-after": "soon"}, 0.0),
+    ({"retry-after": "Mon, 99 Foo 2024 25:61:00 GMT"}, 0.0),
+])
+def test_retry_after_of_429(headers, expected):
+    assert get_retry_after(FakeAPIError(429, headers)) == expected
+
+
+def test_retry_after_http_date():
+    retry_at = email.utils.formatdate(time.time() + 30, usegmt=True)
+
+    assert 25 < get_retry_after(FakeAPIError(429, {"retry-after": retry_at})) <= 30
+
+
+def test_retry_after_is_none_when_not_rate_limited():
+    assert get_retry_after(FakeAPIError(500, {"retry-after": "3"})) is None
+
+
+def test_malformed_retry_after_is_retried():
+    scheduler = AzureScheduler("test", requests_per_minute=6000, tokens_per_minute=1e9, max_retries=2,
+                               retry_base_seconds=0.01)
+    calls = []
+
+    async def call():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise FakeAPIError(429, {"retry-after": "not a date"})
+        return "ok"
+
+    assert asyncio.run(scheduler.run(call, estimated_tokens=1)) == "ok"
+    assert len(calls) == 2
@@ -0,0 +1,42 @@
+import pytest
+from langchain_core.documents import Document
+
+from phase_2.backend import context_packer
+from phase_2.backend.context_packer import BLOCK_SEPARATOR, count_tokens, pack_context
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    # Token counts estimated from the text length, the tests do not depend on the tokenizer download
+    monkeypatch.setattr(context_packer, "get_encoding", lambda model=None: None)
+
+
+def chunk(source: str, index: int, text: str) -> Document:
+    return Document(page_content=text, metadata={"source": source, "chunk_index": index})
+
+
+def test_blocks_are_packed_by_relevance_within_budget():
+    docs = [(chunk("a.html", 0, "a" * 100), 0.9), (chunk("b.html", 0, "b" * 100), 0.95), (chunk("c.html", 0, "c" * 100), 0.85)]
+
+    context = pack_context(docs, token_budget=90)
+
+    assert context == BLOCK_SEPARATOR.join(["b" * 100, "a" * 100])
+
+
+def test_block_over_budget_is_split_into_its_chunks():
+    # Adjacent chunks are merged into one block that is larger than the whole budget
+    docs = [(chunk("a.html", 0, "x" * 100), 0.82), (chunk("a.html", 1, "y" * 100), 0.95), (chunk("a.html", 2, "z" * 100), 0.81)]
+
+    context = pack_context(docs, token_budget=100)
+
+    assert "y" * 100 in context
+    assert count_tokens(context) <= 100
+
+
+def test_single_chunk_over_budget_is_cut():
+    docs = [(chunk("a.html", 0, "most relevant " * 50), 0.95), (chunk("b.html", 0, "other " * 100), 0.9)]
+
+    context = pack_context(docs, token_budget=40)
+
+    assert context.startswith("most relevant")
+    assert 0 < count_tokens(context) <= 40
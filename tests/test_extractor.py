@@ -0,0 +1,56 @@
+import json
+
+from app import extractor
+from app.models import empty_form
+
+
+class FakeResponse:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class FakeLLM:
+    """
+    Chat model stand-in that answers the extraction prompt and then every repair prompt from a list.
+    """
+
+    def __init__(self, *answers: dict):
+        self.answers = list(answers)
+        self.prompts = []
+
+    def bind(self, **kwargs):
+        return self
+
+    def invoke(self, messages):
+        self.prompts.append(messages[0]["content"])
+        answer = self.answers.pop(0) if len(self.answers) > 1 else self.answers[0]
+        return FakeResponse(json.dumps(answer, ensure_ascii=False))
+
+
+def make_form(**fields) -> dict:
+    return {**empty_form(), **fields}
+
+
+def test_invalid_field_keeps_value_and_reports_error(monkeypatch):
+    # 123456789 fails the check digit on every try
+    llm = FakeLLM(make_form(lastName="כהן", firstName="דנה", idNumber="123456789", mobilePhone="+972 50-1234567"),
+                  {"idNumber": "123456789"})
+    monkeypatch.setattr(extractor, "llm", llm)
+
+    result, validation_errors = extractor.extract_fields_with_gpt("OCR text")
+
+    assert result["idNumber"] == "123456789"
+    assert set(validation_errors) == {"idNumber"}
+    assert result["lastName"] == "כהן"
+    assert result["mobilePhone"] == "0501234567"
+    assert len(llm.prompts) == 1 + extractor.MAX_REPAIR_ATTEMPTS
+
+
+def test_repaired_field_has_no_error(monkeypatch):
+    llm = FakeLLM(make_form(lastName="כהן", idNumber="123456789"), {"idNumber": "123456782"})
+    monkeypatch.setattr(extractor, "llm", llm)
+
+    result, validation_errors = extractor.extract_fields_with_gpt("OCR text")
+
+    assert result["idNumber"] == "123456782"
+    assert validation_errors == {}